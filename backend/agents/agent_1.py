@@ -1,11 +1,16 @@
 import os
 import json
+import argparse
 import requests
 from openai import OpenAI
 from dotenv import load_dotenv
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from hana_connector import fetch_data_from_hana
+from llm_streaming import stream_json_completion, print_partial_result
+from output_schemas import reconcile_and_repair
+from run_profiler import profile_run
+import similarity_index
+from hana_connector import fetch_data_from_hana, fetch_snapshot_from_hana
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +19,9 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
 
+# Array whose entries are emitted one by one when streaming
+STREAM_ITEM_PATH = ("late_delivery_probability", "orders")
+
 def get_orders(status: str = None, customer: str = None, material: str = None):
     """
     Fetch orders with optional filters.
@@ -46,16 +54,18 @@ def get_order_by_id(order_id: str):
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
+# Example query - replace 'ORDERS' with your actual table name if different
+# You might also need schema prefix like 'MY_SCHEMA"."ORDERS'
+HANA_QUERY = 'SELECT "SalesOrder", "Customer", "Material", "Qty", "DeliveryDate", "Status" FROM SALES_ORDERS_ANALYSIS'
+
 def get_orders_from_hana():
     """
     Fetch orders directly from SAP HANA database.
     Note: You may need to adjust the table name 'ORDERS' to match your actual schema.
     """
     print("Attempting to fetch orders from SAP HANA...")
-    # Example query - replace 'ORDERS' with your actual table name if different
-    # You might also need schema prefix like 'MY_SCHEMA"."ORDERS'
-    query = 'SELECT "SalesOrder", "Customer", "Material", "Qty", "DeliveryDate", "Status" FROM SALES_ORDERS_ANALYSIS'
-    return fetch_data_from_hana(query)
+    query = HANA_QUERY
+    return fetch_snapshot_from_hana(query)
 
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-1.txt")
 
@@ -63,9 +73,11 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read()
 
-def analyze_data(data):
+def analyze_data(data, on_item=None):
     """
     Analyzes the provided data using the system prompt stored in the repo.
+    If on_item is given, the completion is streamed and on_item is called for each
+    per-row verdict as soon as it is complete.
     """
     system_prompt = load_system_prompt()
     
@@ -73,12 +85,23 @@ def analyze_data(data):
     data_str = json.dumps(data, indent=2, default=str)
     
     try:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Here is the sales order data to analyze:\n{data_str}"}
+        ]
+        if on_item is not None:
+            return stream_json_completion(
+                client,
+                messages,
+                STREAM_ITEM_PATH,
+                on_item,
+                model="gpt-4o",
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
         completion = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the sales order data to analyze:\n{data_str}"}
-            ],
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
         )
@@ -151,9 +174,29 @@ def ensure_all_orders_in_output(analysis_result, source_orders):
 
 # Define tools - REMOVED (Not needed for single-task script)
 
-def main():
-    print("--- SAP Sales Order Analysis Agent ---")
-    
+def summarize_distribution(analysis_result):
+    """
+    Recounts late_delivery_probability.summary.probability_distribution from the order rows.
+    """
+    late = analysis_result.get("late_delivery_probability") if isinstance(analysis_result, dict) else None
+    if not isinstance(late, dict):
+        return analysis_result
+    distribution = {"high": 0, "medium": 0, "low": 0, "unknown": 0}
+    for order in late.get("orders") or []:
+        level = str(order.get("risk_level") or "unknown").lower()
+        distribution[level if level in distribution else "unknown"] += 1
+    summary = late.get("summary")
+    if not isinstance(summary, dict):
+        summary = late["summary"] = {}
+    summary["probability_distribution"] = distribution
+    return analysis_result
+
+def run(on_item=None, group_similar=False):
+    """
+    Fetches, cleans and analyzes the sales orders.
+    With group_similar, near-duplicate orders share one model verdict.
+    Returns the analysis result, an error string, or None if no data was found.
+    """
     # Check API availability
     try:
         requests.get(API_BASE_URL)
@@ -200,7 +243,7 @@ def main():
         if isinstance(api_orders, dict) and "error" in api_orders:
              print(f"   API Error: {api_orders['error']}")
         print("   No orders found from any source to analyze.")
-        return
+        return None
 
     # Data Cleaning
     print("2. Cleaning data...")
@@ -226,8 +269,24 @@ def main():
         cleaned_orders.append(cleaned_item)
 
     print("3. Analyzing data with AI...")
-    analysis_result = analyze_data(cleaned_orders)
+    if group_similar:
+        analysis_result = similarity_index.analyze_grouped(
+            "agent_1", cleaned_orders, lambda rows: analyze_data(rows, on_item=on_item), on_item
+        )
+    else:
+        analysis_result = analyze_data(cleaned_orders, on_item=on_item)
+    analysis_result = reconcile_and_repair("agent_1", analysis_result, cleaned_orders, analyze_data)
     analysis_result = ensure_all_orders_in_output(analysis_result, cleaned_orders)
+    if group_similar:
+        analysis_result = summarize_distribution(analysis_result)
+    return analysis_result
+
+def main(stream=False, group_similar=False):
+    print("--- SAP Sales Order Analysis Agent ---")
+    
+    analysis_result = run(on_item=print_partial_result if stream else None, group_similar=group_similar)
+    if analysis_result is None:
+        return
     
     print("\n--- Analysis Result ---")
     if isinstance(analysis_result, dict):
@@ -237,7 +296,17 @@ def main():
     print("-----------------------")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP Sales Order Analysis Agent")
+    parser.add_argument("--stream", action="store_true", help="Stream the model response and print each verdict as soon as it is complete")
+    parser.add_argument("--group-similar", action="store_true", help="Send one representative per group of near-duplicate orders and reuse its verdict")
+    parser.add_argument("--profile", action="store_true", help="Profile the run (cProfile, sampled stacks, tracemalloc) and write the results to PROFILE_DIR")
+    args = parser.parse_args()
+
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
     else:
-        main()
+        with profile_run("agent_1", enabled=args.profile or os.getenv("AGENT_PROFILE") == "1"):
+            main(
+                stream=args.stream or os.getenv("LLM_STREAMING") == "1",
+                group_similar=args.group_similar or os.getenv("SIMILARITY_GROUPING") == "1",
+            )
@@ -1,11 +1,16 @@
 import os
 import json
+import argparse
 import requests
 from openai import OpenAI
 from dotenv import load_dotenv
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from hana_connector import fetch_data_from_hana
+from llm_streaming import stream_json_completion, print_partial_result
+from output_schemas import reconcile_and_repair, combine_stats, fill_missing_rows
+from run_profiler import profile_run
+from hana_connector import fetch_data_from_hana, fetch_snapshot_from_hana
+import classification_memo
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +19,12 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
 
+# Array whose entries are emitted one by one when streaming
+STREAM_ITEM_PATH = ("classification_results",)
+
+# Max number of unseen materials sent to the model per request when the memo is enabled
+MEMO_BATCH_SIZE = int(os.getenv("MATERIAL_MEMO_BATCH_SIZE", "50"))
+
 def get_materials():
     """
     Fetch material master data.
@@ -25,15 +36,17 @@ def get_materials():
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
+# Example query - replace 'MATERIALS' with your actual table name if different
+HANA_QUERY = 'SELECT "Material", "Description", "Plant", "CurrentGroup" FROM MATERIAL_MASTER'
+
 def get_materials_from_hana():
     """
     Fetch materials directly from SAP HANA database.
     Note: You may need to adjust the table name 'MATERIALS' to match your actual schema.
     """
     print("Attempting to fetch materials from SAP HANA...")
-    # Example query - replace 'MATERIALS' with your actual table name if different
-    query = 'SELECT "Material", "Description", "Plant", "CurrentGroup" FROM MATERIAL_MASTER'
-    return fetch_data_from_hana(query)
+    query = HANA_QUERY
+    return fetch_snapshot_from_hana(query)
 
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-2.txt")
 
@@ -41,22 +54,36 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read()
 
-def analyze_data(data):
+def analyze_data(data, system_prompt=None, on_item=None):
     """
     Analyzes the provided data using the system prompt stored in the repo.
+    If on_item is given, the completion is streamed and on_item is called for each
+    per-row verdict as soon as it is complete.
     """
-    system_prompt = load_system_prompt()
+    if system_prompt is None:
+        system_prompt = load_system_prompt()
     
     # Convert data to string (JSON dump)
     data_str = json.dumps(data, indent=2, default=str)
     
     try:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Here is the material data to classify:\n{data_str}"}
+        ]
+        if on_item is not None:
+            return stream_json_completion(
+                client,
+                messages,
+                STREAM_ITEM_PATH,
+                on_item,
+                model="gpt-4o",
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
         completion = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the material data to classify:\n{data_str}"}
-            ],
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
         )
@@ -65,9 +92,134 @@ def analyze_data(data):
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
-def main():
-    print("--- SAP Material Intelligence Agent ---")
-    
+def summarize_classifications(results):
+    """
+    Recomputes the summary block from classification_results.
+    """
+    summary = {
+        "hazardous_material_count": 0,
+        "external_procurement_count": 0,
+        "inhouse_procurement_count": 0,
+        "uncertain_classifications": 0,
+    }
+    for result in results:
+        hazard = (result.get("hazard_class") or {}).get("classification")
+        if hazard and hazard not in ("none", "unknown"):
+            summary["hazardous_material_count"] += 1
+
+        procurement = (result.get("procurement_type_suggestion") or {}).get("type")
+        if procurement == "F":
+            summary["external_procurement_count"] += 1
+        elif procurement == "E":
+            summary["inhouse_procurement_count"] += 1
+
+        unspsc = result.get("unspsc") or {}
+        confidence = unspsc.get("confidence")
+        if unspsc.get("code") == "unknown" or (isinstance(confidence, (int, float)) and confidence < 0.60):
+            summary["uncertain_classifications"] += 1
+    return summary
+
+def analyze_with_memo(data, on_item=None):
+    """
+    Classifies materials, answering known ones from the classification memo and
+    sending only unseen or changed materials to the model in batches.
+    Returns the same JSON structure as analyze_data.
+    """
+    system_prompt = load_system_prompt()
+    version = classification_memo.prompt_version(system_prompt)
+
+    hits, misses = classification_memo.lookup(data, version)
+    print(f"   Classification memo: {len(hits)} cached, {len(misses)} to classify.")
+
+    by_key = {}
+    data_quality_issues = []
+    reconciliation = []
+    failed_batches = []
+
+    for source, verdict in hits:
+        verdict["material"] = source.get("Material", verdict.get("material"))
+        verdict["description"] = source.get("Description", verdict.get("description"))
+        verdict["plant"] = source.get("Plant", verdict.get("plant"))
+        verdict["current_group"] = source.get("CurrentGroup", verdict.get("current_group"))
+        by_key[classification_memo.memo_key(source) + (str(source.get("Plant") or ""),)] = verdict
+        # Cached verdicts are available immediately; stream them before any model call
+        if on_item is not None:
+            on_item(verdict)
+
+    for start in range(0, len(misses), MEMO_BATCH_SIZE):
+        batch = misses[start:start + MEMO_BATCH_SIZE]
+        batch_result = analyze_data(batch, system_prompt, on_item)
+        # Only validated rows reach the memo; a failed batch goes through the same repair round
+        batch_result = reconcile_and_repair(
+            "agent_2", batch_result, batch, lambda rows: analyze_data(rows, system_prompt), fill_missing=False
+        )
+        if not isinstance(batch_result, dict):
+            continue
+        batch_meta = batch_result.get("meta") or {}
+        reconciliation.append(batch_meta.get("reconciliation"))
+        if batch_meta.get("analysis_error"):
+            # Keep the other batches; materials still missing are flagged for review below
+            failed_batches.append({
+                "materials": [str(item.get("Material") or "") for item in batch],
+                "error": batch_meta["analysis_error"],
+            })
+
+        # Match verdicts back to their source rows by material and plant, as reconciliation did
+        by_source = {
+            (str(row.get("material") or "").strip(), str(row.get("plant") or "").strip()): row
+            for row in batch_result.get("classification_results") or []
+            if isinstance(row, dict)
+        }
+        pairs = []
+        for source in batch:
+            row = by_source.get((str(source.get("Material") or "").strip(), str(source.get("Plant") or "").strip()))
+            if row is not None:
+                pairs.append((source, row))
+        written = classification_memo.store(pairs, version)
+        print(f"   Classified batch of {len(batch)} materials ({written} memo entries written).")
+
+        for source, row in pairs:
+            by_key[classification_memo.memo_key(source) + (str(source.get("Plant") or ""),)] = row
+        issues = (batch_result.get("meta") or {}).get("data_quality_issues")
+        if isinstance(issues, list):
+            data_quality_issues.extend(issues)
+
+    # Keep results in source order
+    results = []
+    for source in data:
+        result = by_key.pop(classification_memo.memo_key(source) + (str(source.get("Plant") or ""),), None)
+        if result is not None:
+            results.append(result)
+    results.extend(by_key.values())
+
+    report = {
+        "meta": {
+            "row_count": len(data),
+            "columns_detected": list(data[0].keys()) if data else [],
+            "data_quality_issues": data_quality_issues,
+            "reconciliation": combine_stats(reconciliation),
+            "failed_batches": failed_batches,
+        },
+        "classification_results": results,
+    }
+    # Unclassified materials are flagged for review instead of dropped (never memoized)
+    placeholders = fill_missing_rows("agent_2", report, data)
+    if placeholders:
+        report["meta"]["reconciliation"]["placeholder_rows"] = placeholders
+    report["summary"] = summarize_classifications(report["classification_results"])
+    return report
+
+def print_memo_stats():
+    version = classification_memo.prompt_version(load_system_prompt())
+    print("\n--- Classification Memo Stats ---")
+    print(json.dumps(classification_memo.get_stats(version), indent=2))
+    print("---------------------------------")
+
+def run(use_memo=True, on_item=None):
+    """
+    Fetches, cleans and analyzes the material master data.
+    Returns the analysis result, an error string, or None if no data was found.
+    """
     # Check API availability
     try:
         requests.get(API_BASE_URL)
@@ -113,7 +265,7 @@ def main():
         if isinstance(api_data, dict) and "error" in api_data:
              print(f"   API Error: {api_data['error']}")
         print("   No materials found from any source to analyze.")
-        return
+        return None
 
     # Data Cleaning (Minimal for now, can be expanded based on actual data shape)
     print("2. Cleaning data...")
@@ -126,7 +278,27 @@ def main():
         cleaned_materials.append(cleaned_item)
 
     print("3. Analyzing data with AI...")
-    analysis_result = analyze_data(cleaned_materials)
+    if use_memo:
+        return analyze_with_memo(cleaned_materials, on_item)
+    analysis_result = analyze_data(cleaned_materials, on_item=on_item)
+    analysis_result = reconcile_and_repair("agent_2", analysis_result, cleaned_materials, analyze_data)
+    if isinstance(analysis_result, dict):
+        analysis_result["summary"] = summarize_classifications(analysis_result.get("classification_results") or [])
+    return analysis_result
+
+def main(use_memo=True, warm_only=False, stream=False):
+    print("--- SAP Material Intelligence Agent ---")
+    
+    if warm_only:
+        analysis_result = run(use_memo=True)
+        if not isinstance(analysis_result, dict) and analysis_result is not None:
+            print(analysis_result)
+        print_memo_stats()
+        return
+
+    analysis_result = run(use_memo, on_item=print_partial_result if stream else None)
+    if analysis_result is None:
+        return
     
     print("\n--- Analysis Result ---")
     if isinstance(analysis_result, dict):
@@ -136,7 +308,22 @@ def main():
     print("-----------------------")
 
 if __name__ == "__main__":
-    if not os.getenv("OPENAI_API_KEY"):
+    parser = argparse.ArgumentParser(description="SAP Material Intelligence Agent")
+    parser.add_argument("--no-memo", action="store_true", help="Send every material to the model, bypassing the classification memo")
+    parser.add_argument("--warm-memo", action="store_true", help="Classify all unseen materials into the memo without printing a report")
+    parser.add_argument("--stream", action="store_true", help="Stream the model response and print each verdict as soon as it is complete")
+    parser.add_argument("--memo-stats", action="store_true", help="Print classification memo hit-rate stats and exit")
+    parser.add_argument("--profile", action="store_true", help="Profile the run (cProfile, sampled stacks, tracemalloc) and write the results to PROFILE_DIR")
+    args = parser.parse_args()
+
+    if args.memo_stats:
+        print_memo_stats()
+    elif not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
     else:
-        main()
+        with profile_run("agent_2", enabled=args.profile or os.getenv("AGENT_PROFILE") == "1"):
+            main(
+                use_memo=not args.no_memo,
+                warm_only=args.warm_memo,
+                stream=args.stream or os.getenv("LLM_STREAMING") == "1",
+            )
@@ -1,11 +1,15 @@
 import os
 import json
+import argparse
 import requests
 from openai import OpenAI
 from dotenv import load_dotenv
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from hana_connector import fetch_data_from_hana
+from llm_streaming import stream_json_completion, print_partial_result
+from output_schemas import reconcile_and_repair
+from run_profiler import profile_run
+from hana_connector import fetch_data_from_hana, fetch_snapshot_from_hana
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +18,9 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
 
+# Array whose entries are emitted one by one when streaming
+STREAM_ITEM_PATH = ("supplier_scorecards",)
+
 def get_suppliers():
     """
     Fetch supplier performance data.
@@ -25,15 +32,17 @@ def get_suppliers():
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
+# Example query - replace 'SUPPLIERS' with your actual table name if different
+HANA_QUERY = 'SELECT "Supplier", "OnTimeDeliveryPct" AS "OnTimeDelivery%", "QualityScore", "Spend", "EmailText" FROM SUPPLIER_PERFORMANCE'
+
 def get_suppliers_from_hana():
     """
     Fetch suppliers directly from SAP HANA database.
     Note: You may need to adjust the table name 'SUPPLIERS' to match your actual schema.
     """
     print("Attempting to fetch suppliers from SAP HANA...")
-    # Example query - replace 'SUPPLIERS' with your actual table name if different
-    query = 'SELECT "Supplier", "OnTimeDeliveryPct" AS "OnTimeDelivery%", "QualityScore", "Spend", "EmailText" FROM SUPPLIER_PERFORMANCE'
-    return fetch_data_from_hana(query)
+    query = HANA_QUERY
+    return fetch_snapshot_from_hana(query)
 
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-3.txt")
 
@@ -41,9 +50,11 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read()
 
-def analyze_data(data):
+def analyze_data(data, on_item=None):
     """
     Analyzes the provided data using the system prompt stored in the repo.
+    If on_item is given, the completion is streamed and on_item is called for each
+    per-row verdict as soon as it is complete.
     """
     system_prompt = load_system_prompt()
     
@@ -51,12 +62,23 @@ def analyze_data(data):
     data_str = json.dumps(data, indent=2, default=str)
     
     try:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Here is the supplier performance data to analyze:\n{data_str}"}
+        ]
+        if on_item is not None:
+            return stream_json_completion(
+                client,
+                messages,
+                STREAM_ITEM_PATH,
+                on_item,
+                model="gpt-4o",
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
         completion = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the supplier performance data to analyze:\n{data_str}"}
-            ],
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
         )
@@ -65,9 +87,38 @@ def analyze_data(data):
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
-def main():
-    print("--- SAP Supplier Intelligence Agent ---")
-    
+def summarize_scorecards(scorecards):
+    """
+    Recomputes portfolio_summary from the supplier scorecards. Suppliers rated High
+    or with a P0 action require immediate attention.
+    """
+    counts = {"High": 0, "Medium": 0, "Low": 0}
+    scores = []
+    attention = []
+    for scorecard in scorecards:
+        assessment = scorecard.get("risk_assessment") or {}
+        level = str(assessment.get("risk_level") or "").capitalize()
+        if level in counts:
+            counts[level] += 1
+        if isinstance(assessment.get("risk_score"), (int, float)):
+            scores.append(assessment["risk_score"])
+        urgent = any(isinstance(a, dict) and a.get("priority") == "P0" for a in scorecard.get("recommended_actions") or [])
+        if level == "High" or urgent:
+            attention.append(scorecard.get("supplier"))
+
+    return {
+        "high_risk_suppliers": counts["High"],
+        "medium_risk_suppliers": counts["Medium"],
+        "low_risk_suppliers": counts["Low"],
+        "average_risk_score": round(sum(scores) / len(scores), 2) if scores else None,
+        "suppliers_requiring_immediate_attention": attention,
+    }
+
+def run(on_item=None):
+    """
+    Fetches, cleans and analyzes the supplier performance data.
+    Returns the analysis result, an error string, or None if no data was found.
+    """
     # Check API availability
     try:
         requests.get(API_BASE_URL)
@@ -113,7 +164,7 @@ def main():
         if isinstance(api_data, dict) and "error" in api_data:
              print(f"   API Error: {api_data['error']}")
         print("   No suppliers found from any source to analyze.")
-        return
+        return None
 
     # Data Cleaning
     print("2. Cleaning data...")
@@ -126,7 +177,18 @@ def main():
         cleaned_suppliers.append(cleaned_item)
 
     print("3. Analyzing data with AI...")
-    analysis_result = analyze_data(cleaned_suppliers)
+    analysis_result = analyze_data(cleaned_suppliers, on_item=on_item)
+    analysis_result = reconcile_and_repair("agent_3", analysis_result, cleaned_suppliers, analyze_data)
+    if isinstance(analysis_result, dict):
+        analysis_result["portfolio_summary"] = summarize_scorecards(analysis_result.get("supplier_scorecards") or [])
+    return analysis_result
+
+def main(stream=False):
+    print("--- SAP Supplier Intelligence Agent ---")
+    
+    analysis_result = run(on_item=print_partial_result if stream else None)
+    if analysis_result is None:
+        return
     
     print("\n--- Analysis Result ---")
     if isinstance(analysis_result, dict):
@@ -136,7 +198,13 @@ def main():
     print("-----------------------")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP Supplier Intelligence Agent")
+    parser.add_argument("--stream", action="store_true", help="Stream the model response and print each verdict as soon as it is complete")
+    parser.add_argument("--profile", action="store_true", help="Profile the run (cProfile, sampled stacks, tracemalloc) and write the results to PROFILE_DIR")
+    args = parser.parse_args()
+
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
     else:
-        main()
+        with profile_run("agent_3", enabled=args.profile or os.getenv("AGENT_PROFILE") == "1"):
+            main(stream=args.stream or os.getenv("LLM_STREAMING") == "1")
@@ -1,11 +1,18 @@
 import os
 import json
+import argparse
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from hana_connector import fetch_data_from_hana
+from llm_streaming import stream_json_completion, print_partial_result
+from output_schemas import reconcile_and_repair
+from run_profiler import profile_run
+import similarity_index
+import inventory_rules
+from hana_connector import fetch_data_from_hana, fetch_snapshot_from_hana
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +21,12 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
 
+# Array whose entries are emitted one by one when streaming
+STREAM_ITEM_PATH = ("inventory_forecasts",)
+
+# Max number of plant shards analyzed concurrently in sharded mode
+SHARD_WORKERS = int(os.getenv("INVENTORY_SHARD_WORKERS", "4"))
+
 def get_inventory():
     """
     Fetch inventory data.
@@ -25,15 +38,21 @@ def get_inventory():
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
-def get_inventory_from_hana():
+# Example query - replace 'INVENTORY' with your actual table name if different
+HANA_QUERY = 'SELECT "Material", "Plant", "CurrentStock", "DailyConsumption" FROM INVENTORY_SNAPSHOT'
+
+def get_inventory_from_hana(plants=None):
     """
     Fetch inventory directly from SAP HANA database.
+    If plants is given, only those plants are read (filter pushed down to HANA).
     Note: You may need to adjust the table name 'INVENTORY' to match your actual schema.
     """
     print("Attempting to fetch inventory from SAP HANA...")
-    # Example query - replace 'INVENTORY' with your actual table name if different
-    query = 'SELECT "Material", "Plant", "CurrentStock", "DailyConsumption" FROM INVENTORY_SNAPSHOT'
-    return fetch_data_from_hana(query)
+    query = HANA_QUERY
+    if plants:
+        query += ' WHERE "Plant" IN (' + ", ".join("?" for _ in plants) + ")"
+        return fetch_snapshot_from_hana(query, list(plants))
+    return fetch_snapshot_from_hana(query)
 
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-4.txt")
 
@@ -41,22 +60,38 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read()
 
-def analyze_data(data):
+def analyze_data(data, on_item=None, as_of_date=None):
     """
     Analyzes the provided data using the system prompt stored in the repo.
+    If on_item is given, the completion is streamed and on_item is called for each
+    per-row verdict as soon as it is complete.
     """
     system_prompt = load_system_prompt()
     
     # Convert data to string (JSON dump)
     data_str = json.dumps(data, indent=2, default=str)
+    user_content = f"Here is the inventory data to analyze:\n{data_str}"
+    if as_of_date:
+        user_content = f"as_of_date: {as_of_date}\n{user_content}"
     
     try:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        if on_item is not None:
+            return stream_json_completion(
+                client,
+                messages,
+                STREAM_ITEM_PATH,
+                on_item,
+                model="gpt-4o",
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
         completion = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the inventory data to analyze:\n{data_str}"}
-            ],
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
         )
@@ -65,9 +100,131 @@ def analyze_data(data):
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
-def main():
-    print("--- SAP Inventory Intelligence Agent ---")
-    
+def summarize_forecasts(forecasts):
+    """
+    Recomputes portfolio_summary counts and the nearest stockout across all forecasts.
+    """
+    not_available = 0
+    p0 = 0
+    nearest = None
+    for forecast in forecasts:
+        if forecast.get("forecast_status") == "not_available":
+            not_available += 1
+        if (forecast.get("reorder_recommendation") or {}).get("urgency") == "P0":
+            p0 += 1
+        stockout = forecast.get("stockout_forecast") or {}
+        days = stockout.get("stockout_in_days")
+        if isinstance(days, (int, float)) and (nearest is None or days < nearest["stockout_in_days"]):
+            nearest = {
+                "material": forecast.get("material"),
+                "plant": forecast.get("plant"),
+                "stockout_date": stockout.get("stockout_date"),
+                "stockout_in_days": days,
+            }
+
+    return {
+        "materials_analyzed": len(forecasts),
+        "materials_not_available": not_available,
+        "p0_urgent_reorders": p0,
+        "nearest_stockout": nearest or {"material": None, "plant": None, "stockout_date": None, "stockout_in_days": None},
+    }
+
+def analyze_sharded(data, on_item=None, max_workers=SHARD_WORKERS, as_of_date=None):
+    """
+    Partitions the inventory by Plant, analyzes the plant shards concurrently and
+    merges them into a single report with recomputed portfolio_summary.
+    Returns the same JSON structure as analyze_data. Failed plants are listed in
+    meta.failed_shards and their rows left out, so reconcile_and_repair re-requests
+    only those rows; an error string is returned only if every shard failed.
+    """
+    shards = {}
+    for item in data:
+        shards.setdefault(str(item.get("Plant") or ""), []).append(item)
+
+    # Pin one as_of_date so every shard forecasts from the same day
+    as_of_date = as_of_date or inventory_rules.resolve_as_of_date(os.getenv("AS_OF_DATE"))
+    print(f"   Analyzing {len(shards)} plant shards with up to {max_workers} concurrent requests...")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        futures = {
+            plant: executor.submit(analyze_data, rows, on_item, as_of_date)
+            for plant, rows in shards.items()
+        }
+        results = {plant: future.result() for plant, future in futures.items()}
+
+    failed = {plant: result for plant, result in results.items() if not isinstance(result, dict)}
+    if len(failed) == len(results):
+        return "; ".join(f"Plant {plant}: {error}" for plant, error in failed.items())
+
+    # Keep the other shards; a failed plant's rows are left for reconciliation to re-request
+    failed_shards = []
+    for plant, error in failed.items():
+        print(f"   Plant shard {plant} ({len(shards[plant])} rows) failed: {error}")
+        failed_shards.append({"plant": plant, "rows": len(shards[plant]), "error": str(error)})
+
+    forecasts = []
+    assumptions = {}
+    data_quality_issues = []
+    notes = []
+    for plant, result in results.items():
+        if plant in failed:
+            continue
+        forecasts.extend(f for f in result.get("inventory_forecasts") or [] if isinstance(f, dict))
+        meta = result.get("meta") or {}
+        for assumption in meta.get("assumptions_used") or []:
+            if isinstance(assumption, dict):
+                assumptions.setdefault(assumption.get("name"), assumption)
+        for issue in meta.get("data_quality_issues") or []:
+            if isinstance(issue, dict):
+                # Row indices are relative to the shard; affected_materials still identifies the rows
+                issue = {k: v for k, v in issue.items() if k != "affected_rows"}
+                issue.setdefault("plant", plant)
+            data_quality_issues.append(issue)
+        plant_notes = (result.get("portfolio_summary") or {}).get("notes")
+        if plant_notes:
+            notes.append(f"Plant {plant}: {plant_notes}")
+
+    # Restore source row order across shards
+    position = {(str(item.get("Material")), str(item.get("Plant"))): i for i, item in enumerate(data)}
+    forecasts.sort(key=lambda f: position.get((str(f.get("material")), str(f.get("plant"))), len(position)))
+
+    summary = summarize_forecasts(forecasts)
+    summary["notes"] = " ".join(notes)
+    return {
+        "meta": {
+            "as_of_date": as_of_date,
+            "row_count": len(data),
+            "columns_detected": list(data[0].keys()) if data else [],
+            "assumptions_used": list(assumptions.values()),
+            "data_quality_issues": data_quality_issues,
+            "failed_shards": failed_shards,
+        },
+        "inventory_forecasts": forecasts,
+        "portfolio_summary": summary,
+    }
+
+def parse_plants(plants):
+    """
+    Normalizes a plant filter to a list of plant strings (or None).
+    Accepts a list of plants or a comma-separated string; raises ValueError otherwise.
+    """
+    if plants is None:
+        return None
+    if isinstance(plants, str):
+        plants = plants.split(",")
+    elif not isinstance(plants, (list, tuple)) or not all(isinstance(p, (str, int)) for p in plants):
+        raise ValueError("plants must be a list of plants or a comma-separated string")
+    return [str(p).strip() for p in plants if str(p).strip()] or None
+
+def run(on_item=None, sharded=False, plants=None, group_similar=False):
+    """
+    Fetches, cleans and analyzes the inventory data, optionally only for the given plants
+    (a list, or a comma-separated string).
+    With group_similar, materials with similar stock and consumption share one model verdict.
+    Returns the analysis result, an error string, or None if no data was found.
+    """
+    plants = parse_plants(plants)
+
     # Check API availability
     try:
         requests.get(API_BASE_URL)
@@ -95,7 +252,7 @@ def main():
     api_data = {}
     
     if hana_available:
-        hana_data = get_inventory_from_hana()
+        hana_data = get_inventory_from_hana(plants)
         if isinstance(hana_data, list):
             inventory_data = hana_data
             print(f"   Retrieved {len(inventory_data)} inventory records from SAP HANA.")
@@ -113,7 +270,7 @@ def main():
         if isinstance(api_data, dict) and "error" in api_data:
              print(f"   API Error: {api_data['error']}")
         print("   No inventory data found from any source to analyze.")
-        return
+        return None
 
     # Data Cleaning
     print("2. Cleaning data...")
@@ -125,8 +282,50 @@ def main():
                 cleaned_item[key] = value.strip()
         cleaned_inventory.append(cleaned_item)
 
+    if plants:
+        selected = {str(plant) for plant in plants}
+        cleaned_inventory = [item for item in cleaned_inventory if str(item.get("Plant")) in selected]
+        print(f"   Selected {len(cleaned_inventory)} records for plants {', '.join(sorted(selected))}.")
+        if not cleaned_inventory:
+            return None
+
     print("3. Analyzing data with AI...")
-    analysis_result = analyze_data(cleaned_inventory)
+    # Validated once, so the prompt, every shard and locally recomputed rows use the same day
+    as_of_date = inventory_rules.resolve_as_of_date(os.getenv("AS_OF_DATE"))
+
+    def analyze(rows):
+        if sharded:
+            return analyze_sharded(rows, on_item, as_of_date=as_of_date)
+        return analyze_data(rows, on_item=on_item, as_of_date=as_of_date)
+
+    if group_similar:
+        analysis_result = similarity_index.analyze_grouped(
+            "agent_4", cleaned_inventory, analyze, on_item,
+            refresh=lambda forecast, item: inventory_rules.apply_reorder_rules(forecast, item, as_of_date),
+        )
+    else:
+        analysis_result = analyze(cleaned_inventory)
+
+    analysis_result = reconcile_and_repair(
+        "agent_4", analysis_result, cleaned_inventory, lambda rows: analyze_data(rows, as_of_date=as_of_date)
+    )
+    if isinstance(analysis_result, dict):
+        notes = (analysis_result.get("portfolio_summary") or {}).get("notes", "")
+        analysis_result["portfolio_summary"] = summarize_forecasts(analysis_result.get("inventory_forecasts") or [])
+        analysis_result["portfolio_summary"]["notes"] = notes
+    return analysis_result
+
+def main(stream=False, sharded=False, plants=None, group_similar=False):
+    print("--- SAP Inventory Intelligence Agent ---")
+    
+    analysis_result = run(
+        on_item=print_partial_result if stream else None,
+        sharded=sharded,
+        plants=plants,
+        group_similar=group_similar,
+    )
+    if analysis_result is None:
+        return
     
     print("\n--- Analysis Result ---")
     if isinstance(analysis_result, dict):
@@ -136,7 +335,21 @@ def main():
     print("-----------------------")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP Inventory Intelligence Agent")
+    parser.add_argument("--stream", action="store_true", help="Stream the model response and print each verdict as soon as it is complete")
+    parser.add_argument("--sharded", action="store_true", help="Analyze each Plant as a separate, concurrent request")
+    parser.add_argument("--plants", help="Comma-separated list of plants to analyze (e.g. 1010,1020)")
+    parser.add_argument("--group-similar", action="store_true", help="Send one representative per group of similar materials and reuse its verdict")
+    parser.add_argument("--profile", action="store_true", help="Profile the run (cProfile, sampled stacks, tracemalloc) and write the results to PROFILE_DIR")
+    args = parser.parse_args()
+
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
     else:
-        main()
+        with profile_run("agent_4", enabled=args.profile or os.getenv("AGENT_PROFILE") == "1"):
+            main(
+                stream=args.stream or os.getenv("LLM_STREAMING") == "1",
+                sharded=args.sharded,
+                plants=parse_plants(args.plants),
+                group_similar=args.group_similar or os.getenv("SIMILARITY_GROUPING") == "1",
+            )
@@ -1,11 +1,17 @@
 import os
 import json
+import argparse
 import requests
 from openai import OpenAI
 from dotenv import load_dotenv
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from hana_connector import fetch_data_from_hana
+from llm_streaming import stream_json_completion, print_partial_result
+from output_schemas import reconcile_and_repair
+from run_profiler import profile_run
+from hana_connector import fetch_data_from_hana, fetch_snapshot_from_hana
+import production_aggregates
+import similarity_index
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +20,12 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
 
+# Array whose entries are emitted one by one when streaming
+STREAM_ITEM_PATH = ("production_delay_predictions",)
+
+# Max number of outlier orders sent to the model alongside the work center aggregates
+MAX_OUTLIER_ORDERS = int(os.getenv("PRODUCTION_MAX_OUTLIERS", "25"))
+
 def get_production_orders():
     """
     Fetch production order data.
@@ -25,15 +37,17 @@ def get_production_orders():
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
+# Example query - replace 'PRODUCTION_ORDERS' with your actual table name if different
+HANA_QUERY = 'SELECT "ProdOrder", "WorkCenter", "StartDate", "EndDate", "Status", "ScrapPct" AS "Scrap%" FROM PRODUCTION_ORDERS_DATA'
+
 def get_production_orders_from_hana():
     """
     Fetch production orders directly from SAP HANA database.
     Note: You may need to adjust the table name 'PRODUCTION_ORDERS' to match your actual schema.
     """
     print("Attempting to fetch production orders from SAP HANA...")
-    # Example query - replace 'PRODUCTION_ORDERS' with your actual table name if different
-    query = 'SELECT "ProdOrder", "WorkCenter", "StartDate", "EndDate", "Status", "ScrapPct" AS "Scrap%" FROM PRODUCTION_ORDERS_DATA'
-    return fetch_data_from_hana(query)
+    query = HANA_QUERY
+    return fetch_snapshot_from_hana(query)
 
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-5.txt")
 
@@ -41,22 +55,46 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read()
 
-def analyze_data(data):
+def analyze_data(data, aggregates=None, on_item=None):
     """
     Analyzes the provided data using the system prompt stored in the repo.
+    If on_item is given, the completion is streamed and on_item is called for each
+    per-row verdict as soon as it is complete.
+    If aggregates are given, they are sent as plant context alongside the order rows.
     """
     system_prompt = load_system_prompt()
     
     # Convert data to string (JSON dump)
     data_str = json.dumps(data, indent=2, default=str)
+    user_content = f"Here is the production order data to analyze:\n{data_str}"
+    if aggregates is not None:
+        aggregates_str = json.dumps(aggregates, indent=2, default=str)
+        user_content = (
+            f"as_of_date: {aggregates['as_of_date']}\n"
+            f"The orders below are the {len(data)} outlier orders out of {aggregates['total_orders']} in the plant. "
+            "Return predictions only for these orders. Use the precomputed work center and status aggregates "
+            "(covering all orders) for congestion, bottleneck identification and the plant_summary.\n"
+            f"Plant aggregates:\n{aggregates_str}\n\n{user_content}"
+        )
     
     try:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        if on_item is not None:
+            return stream_json_completion(
+                client,
+                messages,
+                STREAM_ITEM_PATH,
+                on_item,
+                model="gpt-4o",
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
         completion = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Here is the production order data to analyze:\n{data_str}"}
-            ],
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
         )
@@ -65,9 +103,148 @@ def analyze_data(data):
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
-def main():
-    print("--- SAP Production Intelligence Agent ---")
-    
+def summarize_predictions(predictions, bottlenecks, commentary=None):
+    """
+    Recomputes plant_summary from the predictions. Unavailable and unclassified
+    predictions are left out of the High/Medium/Low counts.
+    """
+    counts = {"High": 0, "Medium": 0, "Low": 0}
+    most_critical = None
+    for prediction in predictions:
+        assessment = prediction.get("delay_assessment") or {}
+        level = str(assessment.get("risk_level") or "").capitalize()
+        if level in counts:
+            counts[level] += 1
+        probability = assessment.get("delay_probability")
+        if isinstance(probability, (int, float)) and (most_critical is None or probability > most_critical["delay_probability"]):
+            most_critical = {"production_order": prediction.get("production_order"), "delay_probability": probability}
+
+    return {
+        "total_orders": len(predictions),
+        "high_risk_orders": counts["High"],
+        "medium_risk_orders": counts["Medium"],
+        "low_risk_orders": counts["Low"],
+        "identified_bottleneck_work_centers": sorted(bottlenecks),
+        "most_critical_order": most_critical or {"production_order": None, "delay_probability": None},
+        "overall_risk_commentary": commentary or f"{counts['High']} of {len(predictions)} orders are high risk.",
+    }
+
+def refresh_prediction(prediction, row, metrics, bottlenecks):
+    """
+    Recomputes the per-order parts of a prediction copied from a similar order
+    (calculated metrics, delay assessment, bottleneck analysis, actions and
+    explanation) from this order's own metrics with the deterministic model in
+    system-prompt-5, and lists them in prediction["recomputed_locally"].
+    """
+    local = production_aggregates.build_local_prediction(row, metrics, bottlenecks)
+    if metrics["risk_score"] is None:
+        # Invalid dates: the prediction is unavailable for this order
+        prediction.clear()
+        prediction.update(local)
+        prediction["recomputed_locally"] = [key for key in local if key not in ("production_order", "work_center", "inputs")]
+        return
+    for key in LOCALLY_SCORED_FIELDS:
+        prediction[key] = local[key]
+    prediction["recomputed_locally"] = list(LOCALLY_SCORED_FIELDS)
+
+# Parts of a copied prediction replaced by the local scorer; only fields outside
+# these (e.g. model notes) still come from the representative's verdict
+LOCALLY_SCORED_FIELDS = ("calculated_metrics", "delay_assessment", "bottleneck_analysis", "recommended_actions", "explanation")
+
+def similarity_refresh(data, aggregates):
+    """
+    Returns the refresh hook for similarity_index.analyze_grouped: looks up each
+    member order's metrics by ProdOrder and calls refresh_prediction.
+    """
+    metrics_by_order = {
+        str(row.get("ProdOrder") or "").strip(): metrics
+        for row, metrics in zip(data, aggregates["order_metrics"])
+    }
+    bottlenecks = set(aggregates["bottleneck_work_centers"])
+
+    def refresh(prediction, row):
+        metrics = metrics_by_order.get(str(row.get("ProdOrder") or "").strip())
+        if metrics is not None:
+            refresh_prediction(prediction, row, metrics, bottlenecks)
+    return refresh
+
+def analyze_with_aggregates(data, on_item=None, group_similar=False):
+    """
+    Pre-aggregates production orders per WorkCenter and Status, sends the model only
+    the aggregates plus the outlier orders, and scores the remaining orders locally
+    with the deterministic model from the system prompt.
+    With group_similar, near-duplicate outliers share one model verdict.
+    Returns the same JSON structure as analyze_data.
+    """
+    aggregates = production_aggregates.aggregate_production_orders(data, os.getenv("AS_OF_DATE"))
+    outlier_indices = production_aggregates.select_outliers(data, aggregates, MAX_OUTLIER_ORDERS)
+    print(f"   Aggregated {len(data)} orders across {len(aggregates['work_centers'])} work centers; "
+          f"{len(outlier_indices)} outliers sent to the model.")
+
+    prompt_aggregates = {k: v for k, v in aggregates.items() if k != "order_metrics"}
+    outlier_rows = []
+    for index in outlier_indices:
+        row = dict(data[index])
+        row["overlapping_orders_count"] = aggregates["order_metrics"][index]["overlapping_orders_count"]
+        outlier_rows.append(row)
+
+    model_result = {}
+    if outlier_rows:
+        if group_similar:
+            model_result = similarity_index.analyze_grouped(
+                "agent_5", outlier_rows, lambda rows: analyze_data(rows, prompt_aggregates, on_item), on_item,
+                refresh=similarity_refresh(data, aggregates),
+            )
+        else:
+            model_result = analyze_data(outlier_rows, prompt_aggregates, on_item)
+        # Outliers the model missed (or all of them, if the request failed) fall back to the local prediction below
+        model_result = reconcile_and_repair(
+            "agent_5", model_result, outlier_rows, lambda rows: analyze_data(rows, prompt_aggregates),
+            fill_missing=False,
+        )
+        if not isinstance(model_result, dict):
+            model_result = {}
+
+    by_order = {}
+    for prediction in model_result.get("production_delay_predictions") or []:
+        if isinstance(prediction, dict):
+            by_order[str(prediction.get("production_order") or "").strip()] = prediction
+
+    model_summary = model_result.get("plant_summary") or {}
+    bottlenecks = set(aggregates["bottleneck_work_centers"])
+    bottlenecks.update(model_summary.get("identified_bottleneck_work_centers") or [])
+
+    predictions = []
+    for row, metrics in zip(data, aggregates["order_metrics"]):
+        prediction = by_order.get(str(row.get("ProdOrder") or "").strip())
+        if prediction is None:
+            prediction = production_aggregates.build_local_prediction(row, metrics, bottlenecks)
+        predictions.append(prediction)
+
+    meta = model_result.get("meta") or {}
+    return {
+        "meta": {
+            "as_of_date": aggregates["as_of_date"],
+            "row_count": len(data),
+            "columns_detected": list(data[0].keys()) if data else [],
+            "assumptions_used": meta.get("assumptions_used") or [],
+            "data_quality_issues": aggregates["data_quality_issues"],
+            "reconciliation": meta.get("reconciliation") or {},
+            "similarity": meta.get("similarity") or {},
+            "analysis_error": meta.get("analysis_error"),
+        },
+        "production_delay_predictions": predictions,
+        "plant_summary": summarize_predictions(
+            predictions, bottlenecks, model_summary.get("overall_risk_commentary")
+        ),
+    }
+
+def run(preaggregate=True, on_item=None, group_similar=False):
+    """
+    Fetches, cleans and analyzes the production orders.
+    With group_similar, near-duplicate orders share one model verdict.
+    Returns the analysis result, an error string, or None if no data was found.
+    """
     # Check API availability
     try:
         requests.get(API_BASE_URL)
@@ -113,7 +290,7 @@ def main():
         if isinstance(api_data, dict) and "error" in api_data:
              print(f"   API Error: {api_data['error']}")
         print("   No production orders found from any source to analyze.")
-        return
+        return None
 
     # Data Cleaning
     print("2. Cleaning data...")
@@ -141,7 +318,32 @@ def main():
         cleaned_data.append(cleaned_item)
 
     print("3. Analyzing data with AI...")
-    analysis_result = analyze_data(cleaned_data)
+    if preaggregate:
+        return analyze_with_aggregates(cleaned_data, on_item, group_similar)
+    if group_similar:
+        aggregates = production_aggregates.aggregate_production_orders(cleaned_data, os.getenv("AS_OF_DATE"))
+        analysis_result = similarity_index.analyze_grouped(
+            "agent_5", cleaned_data, lambda rows: analyze_data(rows, on_item=on_item), on_item,
+            refresh=similarity_refresh(cleaned_data, aggregates),
+        )
+    else:
+        analysis_result = analyze_data(cleaned_data, on_item=on_item)
+    analysis_result = reconcile_and_repair("agent_5", analysis_result, cleaned_data, analyze_data)
+    if isinstance(analysis_result, dict):
+        model_summary = analysis_result.get("plant_summary") or {}
+        analysis_result["plant_summary"] = summarize_predictions(
+            analysis_result.get("production_delay_predictions") or [],
+            set(model_summary.get("identified_bottleneck_work_centers") or []),
+            model_summary.get("overall_risk_commentary"),
+        )
+    return analysis_result
+
+def main(preaggregate=True, stream=False, group_similar=False):
+    print("--- SAP Production Intelligence Agent ---")
+    
+    analysis_result = run(preaggregate, on_item=print_partial_result if stream else None, group_similar=group_similar)
+    if analysis_result is None:
+        return
     
     print("\n--- Analysis Result ---")
     if isinstance(analysis_result, dict):
@@ -151,7 +353,19 @@ def main():
     print("-----------------------")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP Production Intelligence Agent")
+    parser.add_argument("--raw", action="store_true", help="Send every production order to the model instead of aggregates plus outliers")
+    parser.add_argument("--stream", action="store_true", help="Stream the model response and print each verdict as soon as it is complete")
+    parser.add_argument("--group-similar", action="store_true", help="Send one representative per group of near-duplicate orders and reuse its verdict")
+    parser.add_argument("--profile", action="store_true", help="Profile the run (cProfile, sampled stacks, tracemalloc) and write the results to PROFILE_DIR")
+    args = parser.parse_args()
+
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
     else:
-        main()
+        with profile_run("agent_5", enabled=args.profile or os.getenv("AGENT_PROFILE") == "1"):
+            main(
+                preaggregate=not args.raw,
+                stream=args.stream or os.getenv("LLM_STREAMING") == "1",
+                group_similar=args.group_similar or os.getenv("SIMILARITY_GROUPING") == "1",
+            )
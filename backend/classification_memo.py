@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Persistent memo of per-material classification verdicts (agent_2).
+# Entries are keyed by normalized Material + Description and versioned by the
+# system prompt hash, so editing the prompt invalidates every cached verdict.
+
+MEMO_PATH = os.getenv(
+    "MATERIAL_MEMO_PATH",
+    os.path.join(os.path.dirname(__file__), "cache", "classification_memo.sqlite3"),
+)
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    """
+    Opens (once per process) the SQLite memo database and creates its tables.
+    """
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(MEMO_PATH)), exist_ok=True)
+        _conn = sqlite3.connect(MEMO_PATH, check_same_thread=False)
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classification_memo (
+                material_key TEXT NOT NULL,
+                description_key TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                verdict_json TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (material_key, description_key, prompt_version)
+            )
+            """
+        )
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classification_memo_stats (
+                prompt_version TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        _conn.commit()
+    return _conn
+
+
+def prompt_version(system_prompt):
+    """
+    Returns a short, stable hash of the system prompt used to version memo entries.
+    """
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(value):
+    return " ".join(str(value or "").split()).upper()
+
+
+def memo_key(item):
+    """
+    Builds the (material, description) memo key from a source row or a model result row.
+    """
+    material = item.get("Material") or item.get("material")
+    description = item.get("Description") or item.get("description")
+    return _normalize(material), _normalize(description)
+
+
+def lookup(items, version):
+    """
+    Splits source rows into memo hits and misses.
+    Returns (hits, misses) where hits is a list of (source_row, cached_verdict) pairs.
+    """
+    hits = []
+    misses = []
+    with _lock:
+        conn = _get_conn()
+        for item in items:
+            material_key, description_key = memo_key(item)
+            row = conn.execute(
+                "SELECT verdict_json FROM classification_memo "
+                "WHERE material_key = ? AND description_key = ? AND prompt_version = ?",
+                (material_key, description_key, version),
+            ).fetchone()
+            if row and material_key:
+                hits.append((item, json.loads(row[0])))
+            else:
+                misses.append(item)
+
+        conn.execute(
+            "INSERT INTO classification_memo_stats (prompt_version, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT(prompt_version) DO UPDATE SET "
+            "hits = hits + excluded.hits, misses = misses + excluded.misses",
+            (version, len(hits), len(misses)),
+        )
+        conn.commit()
+    return hits, misses
+
+
+def store(pairs, version):
+    """
+    Saves model classification results (entries of classification_results) to the memo.
+    pairs is a list of (source_row, result); entries are keyed from the source row, so a
+    model that normalizes the echoed material or description still produces memo hits.
+    Returns the number of entries written.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for source, result in pairs:
+        if not isinstance(result, dict):
+            continue
+        material_key, description_key = memo_key(source)
+        if not material_key:
+            continue
+        rows.append((material_key, description_key, version, json.dumps(result, default=str), now))
+
+    with _lock:
+        conn = _get_conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO classification_memo "
+            "(material_key, description_key, prompt_version, verdict_json, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    return len(rows)
+
+
+def get_stats(version=None):
+    """
+    Returns entry counts and lookup hit rate, for one prompt version or across all versions.
+    """
+    with _lock:
+        conn = _get_conn()
+        if version:
+            entries = conn.execute(
+                "SELECT COUNT(*) FROM classification_memo WHERE prompt_version = ?", (version,)
+            ).fetchone()[0]
+            counters = conn.execute(
+                "SELECT COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0) "
+                "FROM classification_memo_stats WHERE prompt_version = ?",
+                (version,),
+            ).fetchone()
+        else:
+            entries = conn.execute("SELECT COUNT(*) FROM classification_memo").fetchone()[0]
+            counters = conn.execute(
+                "SELECT COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0) FROM classification_memo_stats"
+            ).fetchone()
+
+    hits, misses = counters
+    lookups = hits + misses
+    return {
+        "prompt_version": version or "all",
+        "entries": entries,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def clear(version=None):
+    """
+    Deletes memo entries, either for a single prompt version or all of them.
+    """
+    with _lock:
+        conn = _get_conn()
+        if version:
+            conn.execute("DELETE FROM classification_memo WHERE prompt_version = ?", (version,))
+            conn.execute("DELETE FROM classification_memo_stats WHERE prompt_version = ?", (version,))
+        else:
+            conn.execute("DELETE FROM classification_memo")
+            conn.execute("DELETE FROM classification_memo_stats")
+        conn.commit()
@@ -1,5 +1,10 @@
 
 import os
+import re
+import time
+import queue
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 try:
@@ -50,33 +55,346 @@ def get_hana_connection():
         print(f"Failed to connect to SAP HANA: {str(e)}")
         return None
 
-def fetch_data_from_hana(query):
+# Optional connection pool for long-lived processes such as the worker service.
+# With HANA_POOL_SIZE=0 (the default) every query opens and closes its own connection.
+HANA_POOL_SIZE = int(os.getenv("HANA_POOL_SIZE", "0"))
+_connection_pool = queue.LifoQueue()
+
+
+def configure_connection_pool(size):
+    """
+    Sets the number of idle connections kept open for reuse. 0 disables pooling.
+    """
+    global HANA_POOL_SIZE
+    HANA_POOL_SIZE = max(0, int(size))
+    while _connection_pool.qsize() > HANA_POOL_SIZE:
+        release_hana_connection(_connection_pool.get_nowait(), healthy=False)
+
+
+def acquire_hana_connection():
+    """
+    Returns an idle pooled connection if one is available, otherwise opens a new one.
+    """
+    while HANA_POOL_SIZE > 0:
+        try:
+            conn = _connection_pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            if conn.isconnected():
+                return conn
+        except Exception:
+            pass
+        release_hana_connection(conn, healthy=False)
+    return get_hana_connection()
+
+
+def release_hana_connection(conn, healthy=True):
+    """
+    Returns a connection to the pool, or closes it if pooling is off, the pool is full,
+    or the connection failed.
+    """
+    if conn is None:
+        return
+    if healthy and _connection_pool.qsize() < HANA_POOL_SIZE:
+        _connection_pool.put(conn)
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+# Rows fetched per network round trip when reading a result set (hdbcli defaults to 32)
+HANA_FETCH_SIZE = int(os.getenv("HANA_FETCH_SIZE", "1000"))
+
+
+def _read_cursor(cursor, query, params=None):
+    """
+    Executes a query on an open cursor and returns the rows as a list of dictionaries.
+    """
+    if HANA_FETCH_SIZE > 0 and hasattr(cursor, "setfetchsize"):
+        cursor.setfetchsize(HANA_FETCH_SIZE)
+    if params:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
+
+    # Fetch column names
+    columns = [column[0] for column in cursor.description]
+
+    # Convert to list of dicts
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fetch_data_from_hana(query, params=None):
     """
     Executes a SQL query and returns the results as a list of dictionaries.
     """
-    conn = get_hana_connection()
+    conn = acquire_hana_connection()
     if conn:
         try:
             cursor = conn.cursor()
-            cursor.execute(query)
-            
-            # Fetch column names
-            columns = [column[0] for column in cursor.description]
-            
-            # Fetch all rows
-            rows = cursor.fetchall()
-            
-            # Convert to list of dicts
-            results = []
-            for row in rows:
-                results.append(dict(zip(columns, row)))
-            
-            conn.close()
+            results = _read_cursor(cursor, query, params)
+            cursor.close()
+            release_hana_connection(conn)
             return results
         except Exception as e:
             print(f"Error executing query: {e}")
-            if conn:
-                conn.close()
+            release_hana_connection(conn, healthy=False)
             return {"error": str(e)}
     else:
         return {"error": "Could not establish connection to SAP HANA."}
+
+
+# ------------------------------------------------------------
+# Process-wide snapshot cache
+# ------------------------------------------------------------
+# Agents that read the same master data tables (MATERIAL_MASTER,
+# INVENTORY_SNAPSHOT, SALES_ORDERS_ANALYSIS, ...) share one snapshot per
+# query. Entries expire after SNAPSHOT_CACHE_TTL seconds, the least recently
+# used entry is evicted beyond SNAPSHOT_CACHE_MAX_ENTRIES, and concurrent
+# requests for the same key wait on a single in-flight HANA round trip.
+
+SNAPSHOT_CACHE_TTL = float(os.getenv("SNAPSHOT_CACHE_TTL", "300"))
+SNAPSHOT_CACHE_MAX_ENTRIES = int(os.getenv("SNAPSHOT_CACHE_MAX_ENTRIES", "32"))
+
+_snapshot_lock = threading.Lock()
+_snapshot_cache = OrderedDict()  # key -> (expires_at, tables, rows)
+_snapshot_inflight = {}  # key -> threading.Event
+_snapshot_stats = {"hits": 0, "misses": 0, "waits": 0, "evictions": 0}
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+((?:"?[\w$]+"?\.)?"?[\w$]+"?)', re.IGNORECASE)
+
+
+def normalize_query(query):
+    """
+    Collapses whitespace and drops a trailing semicolon so equivalent query text shares a cache key.
+    """
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+def _tables_in(query):
+    return {match.replace('"', "").split(".")[-1].upper() for match in _TABLE_PATTERN.findall(query)}
+
+
+def _copy_rows(rows):
+    # Callers get their own row dicts, so one agent cannot modify another agent's snapshot
+    return [dict(row) for row in rows]
+
+
+def _snapshot_key(query, params):
+    return normalize_query(query), tuple(params) if params else ()
+
+
+def fetch_snapshot_from_hana(query, params=None, ttl=None):
+    """
+    Cached variant of fetch_data_from_hana for master/snapshot tables.
+    Returns a list of dictionaries (fresh row dicts per caller), or an error dict.
+    Errors are never cached, but callers that joined a failing fetch get its error
+    instead of retrying one after another.
+    """
+    key = _snapshot_key(query, params)
+    ttl = SNAPSHOT_CACHE_TTL if ttl is None else ttl
+
+    while True:
+        with _snapshot_lock:
+            entry = _snapshot_cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                _snapshot_cache.move_to_end(key)
+                _snapshot_stats["hits"] += 1
+                return _copy_rows(entry[2])
+            if entry:
+                del _snapshot_cache[key]
+
+            inflight = _snapshot_inflight.get(key)
+            if inflight is None:
+                inflight = threading.Event()
+                _snapshot_inflight[key] = inflight
+                _snapshot_stats["misses"] += 1
+                break
+            _snapshot_stats["waits"] += 1
+
+        # Another caller is fetching this key; wait for it and re-check the cache
+        inflight.wait()
+        with _snapshot_lock:
+            entry = _snapshot_cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                _snapshot_cache.move_to_end(key)
+                return _copy_rows(entry[2])
+        error = getattr(inflight, "error", None)
+        if error is not None:
+            return dict(error)
+        # The in-flight fetch was invalidated; retry as the fetcher
+
+    result = None
+    try:
+        result = fetch_data_from_hana(query, params)
+        if isinstance(result, list):
+            with _snapshot_lock:
+                if _snapshot_inflight.get(key) is inflight:
+                    _snapshot_cache[key] = (time.monotonic() + ttl, _tables_in(key[0]), result)
+                    _snapshot_cache.move_to_end(key)
+                    while len(_snapshot_cache) > SNAPSHOT_CACHE_MAX_ENTRIES:
+                        _snapshot_cache.popitem(last=False)
+                        _snapshot_stats["evictions"] += 1
+            return _copy_rows(result)
+        return result
+    finally:
+        with _snapshot_lock:
+            if _snapshot_inflight.get(key) is inflight:
+                del _snapshot_inflight[key]
+        if not isinstance(result, list):
+            # Shared with the callers waiting on this fetch only
+            inflight.error = result if isinstance(result, dict) else {"error": "Snapshot fetch failed."}
+        inflight.set()
+
+
+def prime_snapshot(query, params, rows, ttl=None):
+    """
+    Stores rows fetched elsewhere (e.g. by fetch_many_from_hana) as the cached snapshot
+    for query/params, so the next fetch_snapshot_from_hana call is a cache hit.
+    """
+    key = _snapshot_key(query, params)
+    ttl = SNAPSHOT_CACHE_TTL if ttl is None else ttl
+    with _snapshot_lock:
+        _snapshot_cache[key] = (time.monotonic() + ttl, _tables_in(key[0]), _copy_rows(rows))
+        _snapshot_cache.move_to_end(key)
+        while len(_snapshot_cache) > SNAPSHOT_CACHE_MAX_ENTRIES:
+            _snapshot_cache.popitem(last=False)
+            _snapshot_stats["evictions"] += 1
+
+
+def invalidate_snapshot(query=None, params=None, table=None):
+    """
+    Drops cached snapshots.
+    - query (+ params): drop that exact entry
+    - table: drop every entry reading from that table
+    - neither: clear the whole cache
+    Returns the number of entries removed. In-flight fetches for removed keys are not stored.
+    """
+    with _snapshot_lock:
+        if query is not None:
+            keys = [_snapshot_key(query, params)]
+        elif table is not None:
+            table = table.replace('"', "").split(".")[-1].upper()
+            keys = [key for key, entry in _snapshot_cache.items() if table in entry[1]]
+            keys += [key for key in _snapshot_inflight if table in _tables_in(key[0])]
+        else:
+            keys = list(_snapshot_cache) + list(_snapshot_inflight)
+
+        removed = 0
+        for key in keys:
+            if _snapshot_cache.pop(key, None) is not None:
+                removed += 1
+            # Detach in-flight fetches so their (possibly stale) result is not cached
+            _snapshot_inflight.pop(key, None)
+        return removed
+
+
+def get_snapshot_cache_stats():
+    """
+    Returns cache size and hit/miss/wait/eviction counters.
+    """
+    with _snapshot_lock:
+        stats = dict(_snapshot_stats)
+        stats["entries"] = len(_snapshot_cache)
+        return stats
+
+
+# ------------------------------------------------------------
+# Bulk fetch
+# ------------------------------------------------------------
+# A full refresh reads SALES_ORDERS_ANALYSIS, MATERIAL_MASTER,
+# SUPPLIER_PERFORMANCE, INVENTORY_SNAPSHOT and PRODUCTION_ORDERS_DATA.
+# fetch_many_from_hana runs those queries on one connection (one login
+# handshake instead of five) and, by default, inside a single REPEATABLE READ
+# transaction so every agent sees the same point-in-time snapshot.
+
+
+def _split_query(spec):
+    if isinstance(spec, (tuple, list)):
+        return spec[0], (spec[1] if len(spec) > 1 else None)
+    return spec, None
+
+
+def _fetch_on_connection(conn, queries, consistent):
+    results = {}
+    if consistent:
+        conn.setautocommit(False)
+    try:
+        cursor = conn.cursor()
+        try:
+            if consistent:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            for name, spec in queries.items():
+                query, params = _split_query(spec)
+                try:
+                    results[name] = _read_cursor(cursor, query, params)
+                except Exception as e:
+                    print(f"Error executing query for {name}: {e}")
+                    results[name] = {"error": str(e)}
+                    if consistent:
+                        # A failed statement can abort the transaction, and results read in a new
+                        # one would not share the snapshot: fail the whole bulk fetch instead
+                        aborted = {"error": f"Bulk fetch aborted: query for {name} failed: {e}"}
+                        for other in queries:
+                            if other != name:
+                                results[other] = dict(aborted)
+                        break
+        finally:
+            cursor.close()
+    finally:
+        if consistent:
+            # Read-only transaction: end it and return the connection to autocommit mode
+            conn.rollback()
+            conn.setautocommit(True)
+    return results
+
+
+def fetch_many_from_hana(queries, consistent=True, parallel=False, prime_cache=True, ttl=None):
+    """
+    Runs several queries in one bulk fetch and returns {name: rows or {"error": ...}}.
+    queries maps a name (e.g. an agent id) to a SQL string or a (sql, params) tuple.
+    - default: one connection, queries executed back to back on a single cursor;
+      with consistent=True they share one REPEATABLE READ transaction snapshot, and
+      if any query fails every result is an error (no mix of snapshots is returned).
+    - parallel=True: each query runs on its own connection concurrently (lower latency
+      for large tables, but no cross-table snapshot guarantee; consistent is ignored).
+      Connections come from the pool, so with HANA_POOL_SIZE=0 (the default) this
+      opens and closes one new connection per query.
+    With prime_cache=True successful results are stored in the snapshot cache, so
+    agents calling fetch_snapshot_from_hana with the same query read them locally.
+    """
+    started = time.monotonic()
+    if parallel:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max(1, len(queries))) as executor:
+            futures = {
+                name: executor.submit(fetch_data_from_hana, *_split_query(spec))
+                for name, spec in queries.items()
+            }
+            results = {name: future.result() for name, future in futures.items()}
+    else:
+        conn = acquire_hana_connection()
+        if not conn:
+            return {name: {"error": "Could not establish connection to SAP HANA."} for name in queries}
+        try:
+            results = _fetch_on_connection(conn, queries, consistent)
+            release_hana_connection(conn)
+        except Exception as e:
+            print(f"Error during bulk fetch: {e}")
+            release_hana_connection(conn, healthy=False)
+            return {name: {"error": str(e)} for name in queries}
+
+    if prime_cache:
+        for name, spec in queries.items():
+            if isinstance(results.get(name), list):
+                query, params = _split_query(spec)
+                prime_snapshot(query, params, results[name], ttl)
+
+    rows = sum(len(r) for r in results.values() if isinstance(r, list))
+    mode = "parallel" if parallel else ("single transaction" if consistent else "single connection")
+    print(f"Bulk fetched {len(queries)} queries ({rows} rows, {mode}) in {time.monotonic() - started:.2f}s")
+    return results
@@ -0,0 +1,163 @@
+import math
+from datetime import date, timedelta
+
+from production_aggregates import parse_date
+
+# Deterministic reorder rules from system-prompt-4 (agent_4), used to recompute
+# the rate-based fields of a forecast locally instead of asking the model again
+# (e.g. for verdicts copied between similar materials). The defaults and the
+# urgency bands below must match the prompt's REORDER QUANTITY LOGIC section.
+
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_BUFFER_DAYS = 7
+
+# Fields of a forecast written by apply_reorder_rules
+LOCAL_FIELDS = ("forecast_status", "days_of_supply", "stockout_forecast", "reorder_recommendation", "recommended_actions")
+
+ACTIONS_BY_URGENCY = {
+    "P0": [
+        ("P0", "Place a reorder of {qty} units immediately and expedite delivery"),
+        ("P1", "Allocate remaining stock to critical demand until replenishment arrives"),
+    ],
+    "P1": [
+        ("P1", "Schedule a reorder of {qty} units within the lead time"),
+    ],
+    "P2": [
+        ("P2", "Monitor stock levels; no reorder needed yet"),
+    ],
+    "not_available": [
+        ("P1", "Review stock and consumption data"),
+    ],
+}
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_as_of_date(value=None):
+    """
+    Returns value as an ISO date string, falling back to today when it is missing or
+    not a valid YYYY-MM-DD date (as production_aggregates does for agent_5).
+    """
+    parsed = parse_date(value) if value else None
+    if value and parsed is None:
+        print(f"   Ignoring invalid as_of_date {value!r}; using today.")
+    return (parsed or date.today()).isoformat()
+
+
+def urgency_for(days_of_supply, lead_time_days, buffer_days):
+    if days_of_supply <= lead_time_days:
+        return "P0"
+    if days_of_supply <= lead_time_days + buffer_days:
+        return "P1"
+    return "P2"
+
+
+def compute_reorder(item, as_of_date):
+    """
+    Applies the system-prompt-4 rules to one inventory row. Returns a dict with
+    days_of_supply, the stockout and the reorder calculation, or None when the row
+    cannot be forecast (negative stock or non-positive consumption).
+    """
+    stock = number(item.get("CurrentStock"))
+    consumption = number(item.get("DailyConsumption"))
+    if stock is None or stock < 0 or consumption is None or consumption <= 0:
+        return None
+
+    safety_stock = number(item.get("SafetyStock"))
+    lead_time_days = number(item.get("LeadTimeDays")) or DEFAULT_LEAD_TIME_DAYS
+    buffer_days = number(item.get("BufferDays")) or DEFAULT_BUFFER_DAYS
+    days_of_supply = stock / consumption
+    # The stockout is measured against the safety threshold when there is one
+    stockout_in_days = math.floor((stock - (safety_stock or 0)) / consumption)
+
+    lead_time_demand = consumption * lead_time_days
+    buffer_demand = consumption * buffer_days
+    target = (safety_stock or 0) + lead_time_demand + buffer_demand
+    reorder_qty_raw = max(0, target - stock)
+    adjustments = []
+    min_order_qty = number(item.get("MinOrderQty"))
+    if min_order_qty and 0 < reorder_qty_raw < min_order_qty:
+        reorder_qty_raw = min_order_qty
+        adjustments.append("min_order_qty_enforced")
+    lot_size = number(item.get("LotSize"))
+    if lot_size and reorder_qty_raw > 0:
+        reorder_qty = int(math.ceil(reorder_qty_raw / lot_size) * lot_size)
+        adjustments.append("rounded_to_lot_size")
+    else:
+        reorder_qty = math.ceil(reorder_qty_raw)
+
+    as_of = parse_date(as_of_date) or date.today()
+    return {
+        "days_of_supply": round(days_of_supply, 2),
+        "safety_stock_used": safety_stock is not None,
+        "stockout_in_days": stockout_in_days,
+        "stockout_date": (as_of + timedelta(days=stockout_in_days)).isoformat(),
+        "suggested_reorder_qty": reorder_qty,
+        "urgency": urgency_for(days_of_supply, lead_time_days, buffer_days),
+        "calculation_trace": {
+            "lead_time_days": lead_time_days,
+            "buffer_days": buffer_days,
+            "lead_time_demand": lead_time_demand,
+            "buffer_demand": buffer_demand,
+            "target_stock_level": target,
+            "reorder_qty_raw": reorder_qty_raw,
+            "adjustments_applied": adjustments,
+        },
+    }
+
+
+def apply_reorder_rules(forecast, item, as_of_date):
+    """
+    Overwrites the rate-based fields of forecast (days of supply, stockout, reorder
+    quantity, urgency, rationale and actions) with the locally computed values for
+    item, and lists them in forecast["recomputed_locally"].
+    """
+    result = compute_reorder(item, as_of_date)
+    stockout = forecast.get("stockout_forecast")
+    stockout = stockout if isinstance(stockout, dict) else {}
+    reorder = forecast.get("reorder_recommendation")
+    reorder = reorder if isinstance(reorder, dict) else {}
+
+    if result is None:
+        forecast["forecast_status"] = "not_available"
+        forecast["days_of_supply"] = None
+        stockout.update({"stockout_date": None, "stockout_in_days": None,
+                         "notes": "CurrentStock < 0 or DailyConsumption <= 0; no stockout computed."})
+        reorder.update({"suggested_reorder_qty": None, "urgency": "not_available",
+                        "rationale": "Forecast not available for this row's stock and consumption.",
+                        "calculation_trace": {}})
+        qty = None
+    else:
+        forecast["forecast_status"] = "available"
+        forecast["days_of_supply"] = result["days_of_supply"]
+        trace = result["calculation_trace"]
+        stockout.update({
+            "stockout_date": result["stockout_date"],
+            "stockout_in_days": result["stockout_in_days"],
+            "method": "simple_rate_based",
+            "notes": "Safety stock used as the stockout threshold." if result["safety_stock_used"] else "No safety stock provided.",
+        })
+        reorder.update({
+            "suggested_reorder_qty": result["suggested_reorder_qty"],
+            "urgency": result["urgency"],
+            "rationale": (
+                f"{result['days_of_supply']:g} days of supply vs {trace['lead_time_days']:g} days lead time "
+                f"(+{trace['buffer_days']:g} buffer days): {result['urgency']}."
+            ),
+            "calculation_trace": trace,
+        })
+        qty = result["suggested_reorder_qty"]
+
+    forecast["stockout_forecast"] = stockout
+    forecast["reorder_recommendation"] = reorder
+    forecast["recommended_actions"] = [
+        {"priority": priority, "action": action.format(qty=qty), "rationale": reorder["rationale"]}
+        for priority, action in ACTIONS_BY_URGENCY[reorder["urgency"]]
+    ]
+    forecast["recomputed_locally"] = list(LOCAL_FIELDS)
+    return forecast
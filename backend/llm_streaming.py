@@ -0,0 +1,109 @@
+import json
+
+# Streaming chat completions with incremental JSON parsing.
+# Per-row verdicts (e.g. each entry of late_delivery_probability.orders) are
+# emitted as soon as their closing brace arrives, instead of after the whole
+# report has been generated.
+
+
+class JsonArrayItemScanner:
+    """
+    Incrementally scans a JSON document and yields each complete object found
+    directly inside the array at item_path (a tuple of object keys).
+    """
+
+    def __init__(self, item_path):
+        self.item_path = tuple(item_path)
+        self.data = ""
+        # Stack entries: ["obj", current_key, expecting_key] or ["arr"]
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.item_start = None
+        self.item_depth = None
+
+    def _key_path(self):
+        return tuple(entry[1] for entry in self.stack if entry[0] == "obj")
+
+    def _at_item_array(self):
+        return bool(self.stack) and self.stack[-1][0] == "arr" and self._key_path() == self.item_path
+
+    def feed(self, text):
+        """
+        Consumes the next chunk of text. Returns a list of completed items.
+        """
+        items = []
+        start = len(self.data)
+        self.data += text
+        data = self.data
+
+        for index in range(start, len(data)):
+            char = data[index]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    top = self.stack[-1] if self.stack else None
+                    if top and top[0] == "obj" and top[2]:
+                        top[1] = json.loads(data[self.string_start:index + 1])
+                        top[2] = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = index
+            elif char == "{":
+                if self.item_start is None and self._at_item_array():
+                    self.item_start = index
+                    self.item_depth = len(self.stack)
+                self.stack.append(["obj", None, True])
+            elif char == "[":
+                self.stack.append(["arr"])
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if char == "}" and self.item_start is not None and len(self.stack) == self.item_depth:
+                    try:
+                        items.append(json.loads(data[self.item_start:index + 1]))
+                    except ValueError:
+                        pass
+                    self.item_start = None
+                    self.item_depth = None
+            elif char == ",":
+                top = self.stack[-1] if self.stack else None
+                if top and top[0] == "obj":
+                    top[1] = None
+                    top[2] = True
+
+        return items
+
+
+def print_partial_result(item):
+    """
+    Default on_item callback: prints each completed verdict as one compact JSON line.
+    """
+    print(f"   [partial] {json.dumps(item, default=str)}", flush=True)
+
+
+def stream_json_completion(client, messages, item_path, on_item=print_partial_result, **kwargs):
+    """
+    Runs a chat completion with stream=True, calling on_item for each complete object
+    in the array at item_path as it arrives. Returns the fully parsed JSON document.
+    Extra kwargs (model, temperature, response_format, ...) are passed to the API.
+    """
+    scanner = JsonArrayItemScanner(item_path)
+    stream = client.chat.completions.create(messages=messages, stream=True, **kwargs)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        for item in scanner.feed(delta):
+            on_item(item)
+    return json.loads(scanner.data)
@@ -0,0 +1,390 @@
+import time
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+# Pydantic schemas for the per-row verdicts of each agent, plus a deterministic
+# reconciliation step: rows are validated, matched to the source keys through
+# a dict index, and only missing or invalid rows are re-requested from the model.
+
+
+class VerdictModel(BaseModel):
+    # Models may add fields; keep them. Numeric ids (e.g. plant 1010) are accepted as strings.
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+
+# agent_1 -----------------------------------------------------------------
+
+class SalesOrderVerdict(VerdictModel):
+    sales_order: str = Field(min_length=1)
+    risk_level: str
+    probability_score: Optional[float] = Field(default=None, ge=0, le=100)
+    risk_reasons: List[str] = []
+    recommended_actions: List[str] = []
+
+
+# agent_2 -----------------------------------------------------------------
+
+class Unspsc(VerdictModel):
+    code: str
+    description: Optional[str] = None
+    confidence: Optional[float] = Field(default=None, ge=0, le=1)
+
+
+class HazardClass(VerdictModel):
+    classification: Literal[
+        "none", "flammable", "corrosive", "toxic", "explosive", "battery_hazard", "chemical", "unknown"
+    ]
+    confidence: Optional[float] = Field(default=None, ge=0, le=1)
+
+
+class ProcurementSuggestion(VerdictModel):
+    type: Literal["F", "E", "unknown"]
+    reason: Optional[str] = None
+
+
+class MaterialClassification(VerdictModel):
+    material: str = Field(min_length=1)
+    plant: Optional[str] = None
+    unspsc: Unspsc
+    hazard_class: HazardClass
+    procurement_type_suggestion: ProcurementSuggestion
+    risk_flags: List[dict] = []
+
+
+# agent_3 -----------------------------------------------------------------
+
+class SupplierRiskAssessment(VerdictModel):
+    risk_score: float = Field(ge=0, le=100)
+    risk_level: str
+
+
+class SupplierScorecard(VerdictModel):
+    supplier: str = Field(min_length=1)
+    risk_assessment: SupplierRiskAssessment
+    recommended_actions: List[dict] = []
+
+
+# agent_4 -----------------------------------------------------------------
+
+class ReorderRecommendation(VerdictModel):
+    urgency: Literal["P0", "P1", "P2", "not_available"]
+
+
+class InventoryForecast(VerdictModel):
+    material: str = Field(min_length=1)
+    plant: str
+    forecast_status: Literal["available", "not_available"]
+    days_of_supply: Optional[float] = None
+    stockout_forecast: dict = {}
+    reorder_recommendation: ReorderRecommendation
+
+
+# agent_5 -----------------------------------------------------------------
+
+class DelayAssessment(VerdictModel):
+    # Null for orders with invalid dates ("prediction unavailable" in system-prompt-5)
+    delay_probability: Optional[float] = Field(default=None, ge=0, le=1)
+    risk_level: str
+    risk_score: Optional[float] = Field(default=None, ge=0, le=100)
+
+
+class ProductionDelayPrediction(VerdictModel):
+    production_order: str = Field(min_length=1)
+    work_center: str
+    delay_assessment: DelayAssessment
+
+
+# Placeholder rows for source rows the model never classified, so they are
+# flagged for manual review instead of disappearing from the report.
+
+def _placeholder_agent_2(item):
+    return {
+        "material": str(item.get("Material") or ""),
+        "plant": str(item.get("Plant") or ""),
+        "description": item.get("Description") or "",
+        "unspsc": {"code": "unknown", "description": None, "confidence": None},
+        "hazard_class": {"classification": "unknown", "confidence": None},
+        "procurement_type_suggestion": {"type": "unknown", "reason": "Not classified in model output"},
+        "risk_flags": [{"type": "not_classified", "details": "Review material manually"}],
+    }
+
+
+def _placeholder_agent_3(item):
+    return {
+        "supplier": str(item.get("Supplier") or ""),
+        "risk_assessment": {
+            "risk_score": None,
+            "risk_level": "unknown",
+            "risk_drivers": ["Not classified in model output"],
+        },
+        "recommended_actions": [
+            {"priority": "P1", "action": "Review supplier manually", "rationale": "Not classified in model output"}
+        ],
+    }
+
+
+def _placeholder_agent_4(item):
+    return {
+        "material": str(item.get("Material") or ""),
+        "plant": str(item.get("Plant") or ""),
+        "inputs": {"current_stock": item.get("CurrentStock"), "daily_consumption": item.get("DailyConsumption")},
+        "forecast_status": "not_available",
+        "days_of_supply": None,
+        "stockout_forecast": {"stockout_date": None, "stockout_in_days": None, "notes": "Not classified in model output"},
+        "reorder_recommendation": {
+            "suggested_reorder_qty": None,
+            "urgency": "not_available",
+            "rationale": "Not classified in model output",
+        },
+        "recommended_actions": [
+            {"priority": "P1", "action": "Review inventory position manually", "rationale": "Not classified in model output"}
+        ],
+    }
+
+
+def _placeholder_agent_5(item):
+    return {
+        "production_order": str(item.get("ProdOrder") or ""),
+        "work_center": str(item.get("WorkCenter") or ""),
+        "inputs": {
+            "start_date": item.get("StartDate"),
+            "end_date": item.get("EndDate"),
+            "status": item.get("Status"),
+            "scrap_percent": item.get("Scrap%"),
+        },
+        "delay_assessment": {
+            "delay_probability": None,
+            "risk_level": "unknown",
+            "risk_score": None,
+            "risk_drivers": ["Not classified in model output"],
+        },
+        "recommended_actions": [
+            {"priority": "P1", "action": "Review order manually", "rationale": "Not classified in model output"}
+        ],
+    }
+
+
+# Where each agent's verdicts live, their schema, how they map to source rows,
+# and the placeholder for rows still missing after repair (agent_1 backfills
+# its own through ensure_all_orders_in_output)
+AGENT_SCHEMAS = {
+    "agent_1": {
+        "path": ("late_delivery_probability", "orders"),
+        "model": SalesOrderVerdict,
+        "source_key": ("SalesOrder",),
+        "row_key": ("sales_order",),
+        "placeholder": None,
+    },
+    "agent_2": {
+        "path": ("classification_results",),
+        "model": MaterialClassification,
+        "source_key": ("Material", "Plant"),
+        "row_key": ("material", "plant"),
+        "placeholder": _placeholder_agent_2,
+    },
+    "agent_3": {
+        "path": ("supplier_scorecards",),
+        "model": SupplierScorecard,
+        "source_key": ("Supplier",),
+        "row_key": ("supplier",),
+        "placeholder": _placeholder_agent_3,
+    },
+    "agent_4": {
+        "path": ("inventory_forecasts",),
+        "model": InventoryForecast,
+        "source_key": ("Material", "Plant"),
+        "row_key": ("material", "plant"),
+        "placeholder": _placeholder_agent_4,
+    },
+    "agent_5": {
+        "path": ("production_delay_predictions",),
+        "model": ProductionDelayPrediction,
+        "source_key": ("ProdOrder",),
+        "row_key": ("production_order",),
+        "placeholder": _placeholder_agent_5,
+    },
+}
+
+
+def _key(item, fields):
+    return tuple(str(item.get(field) if item.get(field) is not None else "").strip() for field in fields)
+
+
+def _rows_container(report, path):
+    node = report
+    for key in path[:-1]:
+        if not isinstance(node, dict):
+            return None
+        node = node.setdefault(key, {})
+    return node if isinstance(node, dict) else None
+
+
+def _match_rows(schema, rows, wanted, stats, errors):
+    """
+    Validates rows and keeps the first valid row for every wanted key.
+    Returns {key: row_dict}.
+    """
+    matched = {}
+    for row in rows if isinstance(rows, list) else []:
+        if not isinstance(row, dict):
+            stats["invalid_rows"] += 1
+            continue
+        try:
+            schema["model"].model_validate(row)
+        except ValidationError as e:
+            stats["invalid_rows"] += 1
+            errors.append(f"{_key(row, schema['row_key'])}: {e.errors()[0].get('msg')}")
+            continue
+        key = _key(row, schema["row_key"])
+        if key not in wanted:
+            stats["unexpected_rows"] += 1
+        elif key in matched:
+            stats["duplicate_rows"] += 1
+        else:
+            matched[key] = row
+    return matched
+
+
+def reconcile_and_repair(agent_id, report, source_rows, reanalyze=None, max_repair_rounds=1, fill_missing=True):
+    """
+    Validates report rows against the agent schema and reconciles them with source_rows:
+    - invalid, duplicate and unexpected rows are dropped;
+    - rows for missing or invalid source keys are re-requested through reanalyze(missing_source_rows),
+      up to max_repair_rounds times, instead of re-running the whole analysis;
+    - the final rows are written back in source order, with the agent's placeholder row for
+      any source row that is still missing (unless fill_missing is False, e.g. when the
+      caller has its own fallback for those rows).
+    A non-dict report (an error string or unparseable output) is treated as one with every
+    source row missing: the rows go through the same repair round and placeholders, and the
+    original error is kept in report["meta"]["analysis_error"].
+    Stats are stored in report["meta"]["reconciliation"].
+    """
+    schema = AGENT_SCHEMAS[agent_id]
+
+    stats = {
+        "source_rows": 0,
+        "valid_rows": 0,
+        "invalid_rows": 0,
+        "duplicate_rows": 0,
+        "unexpected_rows": 0,
+        "missing_rows": 0,
+        "repaired_rows": 0,
+        "repair_requests": 0,
+        "placeholder_rows": 0,
+        "validation_ms": 0.0,
+    }
+    errors = []
+    validation_seconds = 0.0
+    started = time.perf_counter()
+
+    # O(n) index of source rows by key, in source order
+    source_index = {}
+    for item in source_rows:
+        if isinstance(item, dict):
+            key = _key(item, schema["source_key"])
+            if key[0] and key not in source_index:
+                source_index[key] = item
+    stats["source_rows"] = len(source_index)
+    if not source_index:
+        print(f"   Skipping reconciliation: source rows have no {'/'.join(schema['source_key'])} keys.")
+        return report
+
+    analysis_error = None
+    if not isinstance(report, dict):
+        analysis_error = str(report)
+        print(f"   Analysis failed ({analysis_error}); treating all {len(source_index)} rows as missing.")
+        report = {}
+
+    container = _rows_container(report, schema["path"])
+    rows = container.get(schema["path"][-1]) if container is not None else None
+    matched = _match_rows(schema, rows, source_index, stats, errors)
+    validation_seconds += time.perf_counter() - started
+
+    for _ in range(max_repair_rounds):
+        missing = [item for key, item in source_index.items() if key not in matched]
+        if not missing or reanalyze is None:
+            break
+        print(f"   Re-requesting {len(missing)} missing or invalid rows...")
+        stats["repair_requests"] += 1
+        repaired = reanalyze(missing)
+
+        started = time.perf_counter()
+        if isinstance(repaired, dict):
+            repaired_container = _rows_container(repaired, schema["path"])
+            repaired_rows = repaired_container.get(schema["path"][-1]) if repaired_container is not None else None
+            wanted = {_key(item, schema["source_key"]) for item in missing}
+            recovered = _match_rows(schema, repaired_rows, wanted, stats, errors)
+            stats["repaired_rows"] += len(recovered)
+            matched.update(recovered)
+        validation_seconds += time.perf_counter() - started
+
+    started = time.perf_counter()
+    ordered = [matched[key] for key in source_index if key in matched]
+    stats["valid_rows"] = len(ordered)
+    stats["missing_rows"] = stats["source_rows"] - len(ordered)
+    if fill_missing and schema["placeholder"] is not None and stats["missing_rows"]:
+        ordered = [matched[key] if key in matched else schema["placeholder"](item) for key, item in source_index.items()]
+        stats["placeholder_rows"] = stats["missing_rows"]
+    if container is not None:
+        container[schema["path"][-1]] = ordered
+    validation_seconds += time.perf_counter() - started
+    stats["validation_ms"] = round(validation_seconds * 1000, 2)
+
+    meta = report.setdefault("meta", {})
+    if isinstance(meta, dict):
+        meta["reconciliation"] = stats
+        if analysis_error is not None:
+            meta["analysis_error"] = analysis_error
+
+    print(
+        f"   Reconciled {stats['valid_rows']}/{stats['source_rows']} rows "
+        f"({stats['invalid_rows']} invalid, {stats['repaired_rows']} repaired, "
+        f"{stats['missing_rows']} missing, {stats['placeholder_rows']} flagged for review) in {stats['validation_ms']} ms."
+    )
+    if errors:
+        print(f"   First validation error: {errors[0]}")
+    return report
+
+
+def fill_missing_rows(agent_id, report, source_rows):
+    """
+    Adds the agent's placeholder row for every source row without a verdict, keeping
+    source order. Used where reconciliation ran per batch with fill_missing=False.
+    Returns the number of placeholders added.
+    """
+    schema = AGENT_SCHEMAS[agent_id]
+    container = _rows_container(report, schema["path"]) if isinstance(report, dict) else None
+    if container is None or schema["placeholder"] is None:
+        return 0
+    rows = [row for row in container.get(schema["path"][-1]) or [] if isinstance(row, dict)]
+    by_key = {}
+    for row in rows:
+        by_key.setdefault(_key(row, schema["row_key"]), row)
+
+    ordered = []
+    added = 0
+    seen = set()
+    for item in source_rows:
+        key = _key(item, schema["source_key"])
+        if not key[0] or key in seen:
+            continue
+        seen.add(key)
+        row = by_key.pop(key, None)
+        if row is None:
+            row = schema["placeholder"](item)
+            added += 1
+        ordered.append(row)
+    container[schema["path"][-1]] = ordered + list(by_key.values())
+    return added
+
+
+def combine_stats(stats_list):
+    """
+    Sums reconciliation stats from several partial reports (e.g. batches or shards).
+    """
+    combined = {}
+    for stats in stats_list:
+        for name, value in (stats or {}).items():
+            combined[name] = round(combined.get(name, 0) + value, 2)
+    return combined
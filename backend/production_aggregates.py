@@ -0,0 +1,401 @@
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, datetime
+
+# Local pre-aggregation for production orders (agent_5).
+# Computes per-WorkCenter and per-Status statistics plus the deterministic
+# per-order metrics from system-prompt-5, so the model only needs to see the
+# aggregates and the outlier orders.
+
+
+def parse_date(value):
+    """
+    Parses a YYYY-MM-DD string (or date/datetime) into a date. Returns None if invalid.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip()[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_scrap(value):
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return None
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _distribution(values):
+    values = sorted(values)
+    if not values:
+        return {"min": None, "p50": None, "p95": None, "max": None, "mean": None}
+    return {
+        "min": values[0],
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": values[-1],
+        "mean": round(sum(values) / len(values), 2),
+    }
+
+
+def scrap_points(scrap):
+    if scrap is None or scrap < 3:
+        return 0
+    if scrap <= 5:
+        return 10
+    if scrap <= 10:
+        return 20
+    return 30
+
+
+def time_points(days_remaining, status):
+    if days_remaining is None:
+        return 0
+    if days_remaining < 0 and "completed" not in status.lower():
+        return 40
+    if days_remaining <= 2:
+        return 25
+    if days_remaining <= 5:
+        return 15
+    return 0
+
+
+def congestion_points(overlapping):
+    if overlapping >= 3:
+        return 20
+    if overlapping == 2:
+        return 10
+    return 0
+
+
+def status_points(status):
+    lowered = status.lower()
+    if "completed" in lowered:
+        return -30
+    if "in process" in lowered:
+        return 10
+    if "released" in lowered:
+        return 5
+    return 0
+
+
+def risk_level(probability):
+    if probability >= 0.60:
+        return "High"
+    if probability >= 0.30:
+        return "Medium"
+    return "Low"
+
+
+def _overlap_counts(orders):
+    """
+    Counts, for each order, how many other orders in the same work center overlap
+    its planned period. Uses sorted start/end arrays, so each work center costs
+    O(n log n) instead of comparing every pair.
+    """
+    counts = {}
+    by_work_center = defaultdict(list)
+    for index, order in enumerate(orders):
+        if order["start"] and order["end"]:
+            by_work_center[order["work_center"]].append(index)
+
+    for indices in by_work_center.values():
+        starts = sorted(orders[i]["start"] for i in indices)
+        ends = sorted(orders[i]["end"] for i in indices)
+        for i in indices:
+            # Orders starting on/before our end minus those that ended before our start, minus self
+            started = bisect_right(starts, orders[i]["end"])
+            ended = bisect_left(ends, orders[i]["start"])
+            counts[i] = max(0, started - ended - 1)
+    return counts
+
+
+def aggregate_production_orders(rows, as_of_date=None):
+    """
+    Computes per-order metrics and per-WorkCenter / per-Status statistics in one pass
+    over the cleaned production order rows.
+    Returns a dict with "as_of_date", "order_metrics" (aligned with rows),
+    "work_centers", "statuses", "bottleneck_work_centers" and "data_quality_issues".
+    """
+    as_of = parse_date(as_of_date) or date.today()
+
+    orders = []
+    invalid_dates = []
+    invalid_scrap = []
+    for row in rows:
+        status = str(row.get("Status") or "")
+        start = parse_date(row.get("StartDate"))
+        end = parse_date(row.get("EndDate"))
+        scrap = parse_scrap(row.get("Scrap%"))
+        if not start or not end:
+            invalid_dates.append(str(row.get("ProdOrder") or ""))
+        if scrap is None:
+            invalid_scrap.append(str(row.get("ProdOrder") or ""))
+        orders.append({
+            "work_center": str(row.get("WorkCenter") or ""),
+            "status": status,
+            "start": start,
+            "end": end,
+            "scrap": scrap,
+        })
+
+    overlaps = _overlap_counts(orders)
+
+    wc_groups = defaultdict(lambda: {"count": 0, "scrap": [], "durations": [], "overdue": 0,
+                                     "statuses": defaultdict(int), "max_active_overlap": 0, "high_risk": 0})
+    status_groups = defaultdict(lambda: {"count": 0, "scrap": [], "durations": [], "overdue": 0})
+
+    order_metrics = []
+    for index, order in enumerate(orders):
+        duration = (order["end"] - order["start"]).days if order["start"] and order["end"] else None
+        days_remaining = (order["end"] - as_of).days if order["end"] else None
+        overlapping = overlaps.get(index, 0)
+        completed = "completed" in order["status"].lower()
+        overdue = days_remaining is not None and days_remaining < 0 and not completed
+
+        if duration is None:
+            score = None
+        else:
+            score = (scrap_points(order["scrap"]) + time_points(days_remaining, order["status"])
+                     + congestion_points(overlapping) + status_points(order["status"]))
+            score = min(100, max(0, score))
+
+        order_metrics.append({
+            "planned_duration_days": duration,
+            "days_remaining": days_remaining,
+            "overlapping_orders_count": overlapping,
+            "overdue": overdue,
+            "risk_score": score,
+        })
+
+        wc = wc_groups[order["work_center"]]
+        st = status_groups[order["status"]]
+        for group in (wc, st):
+            group["count"] += 1
+            if order["scrap"] is not None:
+                group["scrap"].append(order["scrap"])
+            if duration is not None:
+                group["durations"].append(duration)
+            if overdue:
+                group["overdue"] += 1
+        wc["statuses"][order["status"]] += 1
+        if not completed:
+            wc["max_active_overlap"] = max(wc["max_active_overlap"], overlapping)
+        if score is not None and risk_level(score / 100.0) == "High":
+            wc["high_risk"] += 1
+
+    def summarize(group):
+        scrap = sorted(group["scrap"])
+        return {
+            "orders": group["count"],
+            "scrap_mean": round(sum(scrap) / len(scrap), 2) if scrap else None,
+            "scrap_p95": percentile(scrap, 95),
+            "overdue_orders": group["overdue"],
+            "planned_duration_days": _distribution(group["durations"]),
+        }
+
+    work_centers = {}
+    for name, group in wc_groups.items():
+        stats = summarize(group)
+        stats["status_counts"] = dict(group["statuses"])
+        stats["max_active_overlapping_orders"] = group["max_active_overlap"]
+        stats["high_risk_orders"] = group["high_risk"]
+        work_centers[name] = stats
+
+    statuses = {name: summarize(group) for name, group in status_groups.items()}
+
+    # Bottleneck rule from system-prompt-5: highest active overlap, or >= 2 high-risk orders
+    top_overlap = max((s["max_active_overlapping_orders"] for s in work_centers.values()), default=0)
+    bottlenecks = sorted(
+        name for name, stats in work_centers.items()
+        if (top_overlap > 0 and stats["max_active_overlapping_orders"] == top_overlap)
+        or stats["high_risk_orders"] >= 2
+    )
+
+    data_quality_issues = []
+    if invalid_dates:
+        data_quality_issues.append({
+            "type": "invalid_date",
+            "details": "StartDate or EndDate missing or not in YYYY-MM-DD format",
+            "affected_orders": invalid_dates,
+        })
+    if invalid_scrap:
+        data_quality_issues.append({
+            "type": "invalid_scrap",
+            "details": "Scrap% missing or not numeric",
+            "affected_orders": invalid_scrap,
+        })
+
+    return {
+        "as_of_date": as_of.isoformat(),
+        "total_orders": len(rows),
+        "order_metrics": order_metrics,
+        "work_centers": work_centers,
+        "statuses": statuses,
+        "bottleneck_work_centers": bottlenecks,
+        "data_quality_issues": data_quality_issues,
+    }
+
+
+def select_outliers(rows, aggregates, max_outliers=25):
+    """
+    Picks the orders worth sending to the model: high local risk, overdue, invalid
+    dates, or scrap at/above their work center's p95. Capped at max_outliers,
+    highest risk first. Returns a list of row indices.
+    """
+    work_centers = aggregates["work_centers"]
+    candidates = []
+    for index, (row, metrics) in enumerate(zip(rows, aggregates["order_metrics"])):
+        score = metrics["risk_score"]
+        scrap = parse_scrap(row.get("Scrap%"))
+        wc_p95 = work_centers.get(str(row.get("WorkCenter") or ""), {}).get("scrap_p95")
+        is_outlier = (
+            score is None
+            or metrics["overdue"]
+            or risk_level(score / 100.0) == "High"
+            or (scrap is not None and wc_p95 is not None and scrap >= wc_p95 and scrap >= 3)
+        )
+        if is_outlier:
+            candidates.append((-(score if score is not None else 101), index))
+
+    candidates.sort()
+    return sorted(index for _, index in candidates[:max_outliers])
+
+
+ACTIONS_BY_RISK = {
+    "High": [
+        ("P0", "Expedite order"),
+        ("P0", "Reallocate capacity"),
+        ("P1", "Reduce scrap through quality review"),
+        ("P1", "Consider overtime shift"),
+    ],
+    "Medium": [
+        ("P1", "Monitor daily"),
+        ("P1", "Validate material availability"),
+        ("P1", "Review load balancing"),
+    ],
+    "Low": [
+        ("P2", "Continue planned schedule"),
+    ],
+}
+
+
+def build_unavailable_prediction(row, metrics):
+    """
+    Builds the "prediction unavailable" entry system-prompt-5 requires for orders
+    with invalid dates: no probability, score or risk level, and a manual review action.
+    """
+    return {
+        "production_order": str(row.get("ProdOrder") or ""),
+        "work_center": str(row.get("WorkCenter") or ""),
+        "inputs": {
+            "start_date": str(row.get("StartDate") or ""),
+            "end_date": str(row.get("EndDate") or ""),
+            "status": str(row.get("Status") or ""),
+            "scrap_percent": parse_scrap(row.get("Scrap%")),
+        },
+        "calculated_metrics": {
+            "planned_duration_days": metrics["planned_duration_days"],
+            "days_remaining": metrics["days_remaining"],
+            "overlapping_orders_count": metrics["overlapping_orders_count"],
+        },
+        "delay_assessment": {
+            "delay_probability": None,
+            "risk_level": "unavailable",
+            "risk_score": None,
+            "risk_drivers": ["StartDate or EndDate missing or invalid"],
+        },
+        "bottleneck_analysis": {
+            "is_bottleneck_related": False,
+            "work_center_load_comment": "Not assessed: planned dates are invalid.",
+        },
+        "recommended_actions": [
+            {
+                "priority": "P1",
+                "action": "Correct planned start/end dates",
+                "rationale": "Delay risk cannot be assessed without valid dates.",
+            }
+        ],
+        "explanation": (
+            f"Order {row.get('ProdOrder')} has missing or invalid planned dates, so no delay "
+            "prediction is available. It is listed under data_quality_issues."
+        ),
+    }
+
+
+def build_local_prediction(row, metrics, bottlenecks):
+    """
+    Builds a production_delay_predictions entry from the deterministic scoring
+    model, for orders that are not sent to the model. Orders without a score
+    (invalid dates) get the "prediction unavailable" entry.
+    """
+    if metrics["risk_score"] is None:
+        return build_unavailable_prediction(row, metrics)
+
+    status = str(row.get("Status") or "")
+    scrap = parse_scrap(row.get("Scrap%"))
+    work_center = str(row.get("WorkCenter") or "")
+    score = metrics["risk_score"]
+    probability = round(score / 100.0, 2)
+    level = risk_level(probability)
+
+    drivers = [
+        f"Scrap% {scrap if scrap is not None else 'n/a'}: +{scrap_points(scrap)}",
+        f"Days remaining {metrics['days_remaining']}: +{time_points(metrics['days_remaining'], status)}",
+        f"{metrics['overlapping_orders_count']} overlapping orders at {work_center}: "
+        f"+{congestion_points(metrics['overlapping_orders_count'])}",
+        f"Status '{status}': {status_points(status):+d}",
+    ]
+
+    return {
+        "production_order": str(row.get("ProdOrder") or ""),
+        "work_center": work_center,
+        "inputs": {
+            "start_date": str(row.get("StartDate") or ""),
+            "end_date": str(row.get("EndDate") or ""),
+            "status": status,
+            "scrap_percent": scrap,
+        },
+        "calculated_metrics": {
+            "planned_duration_days": metrics["planned_duration_days"],
+            "days_remaining": metrics["days_remaining"],
+            "overlapping_orders_count": metrics["overlapping_orders_count"],
+        },
+        "delay_assessment": {
+            "delay_probability": probability,
+            "risk_level": level,
+            "risk_score": score,
+            "risk_drivers": drivers,
+        },
+        "bottleneck_analysis": {
+            "is_bottleneck_related": work_center in bottlenecks,
+            "work_center_load_comment": (
+                f"{work_center} is an identified bottleneck work center."
+                if work_center in bottlenecks
+                else f"{work_center} shows no bottleneck signal for this order."
+            ),
+        },
+        "recommended_actions": [
+            {"priority": priority, "action": action, "rationale": f"{level} delay risk (score {score})."}
+            for priority, action in ACTIONS_BY_RISK[level]
+        ],
+        "explanation": (
+            f"Order {row.get('ProdOrder')} scored {score} under the deterministic delay model "
+            f"({level} risk). It was scored locally and not sent for model review."
+        ),
+    }
@@ -0,0 +1,144 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# Opt-in profiling for agent runs (--profile or AGENT_PROFILE=1).
+# Captures, for one run:
+#   <agent>-<timestamp>.pstats      cProfile of the main thread (snakeviz, pstats)
+#   <agent>-<timestamp>.collapsed   sampled stacks of all threads, in collapsed
+#                                   "frame;frame;frame count" format (speedscope,
+#                                   flamegraph.pl)
+#   <agent>-<timestamp>.tracemalloc tracemalloc snapshot (tracemalloc.Snapshot.load)
+# and prints the hottest functions and the largest allocation sites.
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "cache", "profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "15"))
+# Frames kept per allocation traceback; deeper is more precise but slower
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread at a fixed interval and counts identical
+    stacks. Unlike cProfile it also covers worker threads (e.g. sharded requests)
+    and shows time spent waiting on HANA or the model API.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _without_profiler(snapshot):
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+
+
+def summarize_profile(profiler, snapshot, baseline=None, top_n=PROFILE_TOP_N):
+    """
+    Returns a printable summary: top functions by cumulative and own time, and the
+    allocation sites that grew the most during the run (relative to baseline).
+    """
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(top_n)
+    stats.sort_stats("tottime").print_stats(top_n)
+
+    snapshot = _without_profiler(snapshot)
+    if baseline is not None:
+        allocations = snapshot.compare_to(_without_profiler(baseline), "lineno")
+    else:
+        allocations = snapshot.statistics("lineno")
+    out.write(f"Top {top_n} allocation sites (memory held at the end of the run):\n")
+    for stat in allocations[:top_n]:
+        frame = stat.traceback[0]
+        size = getattr(stat, "size_diff", stat.size)
+        count = getattr(stat, "count_diff", stat.count)
+        out.write(f"  {size / 1024:+10.1f} KiB  {count:+8d} blocks  {frame.filename}:{frame.lineno}\n")
+    return out.getvalue()
+
+
+@contextmanager
+def profile_run(name, enabled=True, output_dir=None):
+    """
+    Profiles the enclosed block when enabled; otherwise does nothing.
+    Output files are written to output_dir (default PROFILE_DIR) and a summary is printed.
+    """
+    if not enabled:
+        yield
+        return
+
+    output_dir = output_dir or PROFILE_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    baseline = tracemalloc.take_snapshot()
+    sampler = StackSampler()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(f"{base}.pstats")
+        sampler.write_collapsed(f"{base}.collapsed")
+        snapshot.dump(f"{base}.tracemalloc")
+
+        print("\n--- Profile Summary ---")
+        print(f"Wall time {elapsed:.2f}s, {sampler.samples} stack samples, peak traced memory {peak / (1024 * 1024):.1f} MiB")
+        print(summarize_profile(profiler, snapshot, baseline))
+        print(f"Profile written to {base}.pstats, {base}.collapsed and {base}.tracemalloc")
+        print("-----------------------")
@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import uuid
+import sqlite3
+import argparse
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+# Embedded run store (SQLite).
+# Run metadata is indexed by agent, status and creation time, summaries are
+# searchable through FTS5, and the per-row verdicts of each report are stored
+# as individual rows so a report's orders can be paged and sorted without
+# loading the whole document.
+
+RUN_STORE_PATH = os.getenv(
+    "RUN_STORE_PATH",
+    os.path.join(os.path.dirname(__file__), "cache", "runs.sqlite3"),
+)
+
+# Per-agent array holding the per-row verdicts of a report
+ROW_SECTIONS = {
+    "agent_1": ("late_delivery_probability", "orders"),
+    "agent_2": ("classification_results",),
+    "agent_3": ("supplier_scorecards",),
+    "agent_4": ("inventory_forecasts",),
+    "agent_5": ("production_delay_predictions",),
+}
+
+RISK_RANK = {"high": 3, "p0": 3, "medium": 2, "p1": 2, "low": 1, "p2": 1}
+
+ROW_SORTS = {
+    "probability_score": "score IS NULL, score {order}, row_index",
+    "risk_level": "risk_rank {order}, score IS NULL, score {order}, row_index",
+    "row_index": "row_index {order}",
+}
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _get_conn():
+    """
+    Opens (once per process) the SQLite run store and creates its schema.
+    """
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(RUN_STORE_PATH)), exist_ok=True)
+        _conn = sqlite3.connect(RUN_STORE_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                agent_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                completed_at TEXT,
+                duration INTEGER,
+                error TEXT,
+                parameters_json TEXT,
+                report_json TEXT,
+                row_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_agent_created ON runs (agent_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_status_created ON runs (status, created_at);
+            CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at);
+
+            CREATE TABLE IF NOT EXISTS run_rows (
+                run_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                row_key TEXT,
+                risk_level TEXT,
+                risk_rank INTEGER NOT NULL DEFAULT 0,
+                score REAL,
+                row_json TEXT NOT NULL,
+                PRIMARY KEY (run_id, row_index)
+            );
+            CREATE INDEX IF NOT EXISTS idx_run_rows_score ON run_rows (run_id, score);
+            CREATE INDEX IF NOT EXISTS idx_run_rows_risk ON run_rows (run_id, risk_rank, score);
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5 (run_id UNINDEXED, summary);
+            """
+        )
+        _conn.commit()
+    return _conn
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _row_fields(agent_id, row):
+    """
+    Returns (row_key, risk_level, score) for a per-row verdict.
+    """
+    if agent_id == "agent_1":
+        return row.get("sales_order"), row.get("risk_level"), row.get("probability_score")
+    if agent_id == "agent_2":
+        severities = [str(f.get("severity") or "").lower() for f in row.get("risk_flags") or [] if isinstance(f, dict)]
+        level = max(severities, key=lambda s: RISK_RANK.get(s, 0)) if severities else "none"
+        return row.get("material"), level, (row.get("unspsc") or {}).get("confidence")
+    if agent_id == "agent_3":
+        risk = row.get("risk_assessment") or {}
+        return row.get("supplier"), risk.get("risk_level"), risk.get("risk_score")
+    if agent_id == "agent_4":
+        reorder = row.get("reorder_recommendation") or {}
+        return f"{row.get('material')}@{row.get('plant')}", reorder.get("urgency"), None
+    if agent_id == "agent_5":
+        assessment = row.get("delay_assessment") or {}
+        return row.get("production_order"), assessment.get("risk_level"), assessment.get("risk_score")
+    return None, None, None
+
+
+def _get_path(document, path):
+    node = document
+    for key in path[:-1]:
+        node = node.get(key) if isinstance(node, dict) else None
+    return node if isinstance(node, dict) else None
+
+
+def split_report(agent_id, report):
+    """
+    Splits a report into (document_without_rows, rows).
+    """
+    path = ROW_SECTIONS.get(agent_id)
+    if not path or not isinstance(report, dict):
+        return report, []
+    document = json.loads(json.dumps(report, default=str))
+    parent = _get_path(document, path)
+    if parent is None or not isinstance(parent.get(path[-1]), list):
+        return document, []
+    rows = parent[path[-1]]
+    parent[path[-1]] = []
+    return document, rows
+
+
+def _summary_text(run_id, agent_id, document):
+    """
+    Collects the run id, agent and every string of the report document for full-text search.
+    The per-row verdicts are split out before this is called, so only the summary,
+    meta and other report-level sections are indexed.
+    """
+    parts = [run_id, agent_id]
+
+    def walk(node):
+        if isinstance(node, str):
+            parts.append(node)
+        elif isinstance(node, dict):
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(document)
+    return " ".join(parts)
+
+
+def _to_run(row, report_json=None):
+    run = {
+        "runId": row[0],
+        "agentId": row[1],
+        "status": row[2],
+        "createdAt": row[3],
+        "rowCount": row[8],
+    }
+    if row[4]:
+        run["completedAt"] = row[4]
+    if row[5] is not None:
+        run["duration"] = row[5]
+    if row[6]:
+        run["error"] = row[6]
+    if row[7]:
+        run["parameters"] = json.loads(row[7])
+    if report_json:
+        run["resultJson"] = json.loads(report_json)
+    return run
+
+
+_RUN_COLUMNS = "run_id, agent_id, status, created_at, completed_at, duration, error, parameters_json, row_count"
+
+
+def create_run(agent_id, parameters=None, run_id=None, created_at=None):
+    """
+    Inserts a queued run and returns its runId.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT INTO runs (run_id, agent_id, status, created_at, parameters_json) VALUES (?, ?, 'queued', ?, ?)",
+            (run_id, agent_id, created_at or utc_now(), json.dumps(parameters or {}, default=str)),
+        )
+        conn.commit()
+    return run_id
+
+
+def update_status(run_id, status):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("UPDATE runs SET status = ? WHERE run_id = ?", (status, run_id))
+        conn.commit()
+
+
+def delete_run(run_id):
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM run_rows WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM runs_fts WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        conn.commit()
+
+
+def complete_run(run_id, status, report=None, error=None, duration=None, completed_at=None):
+    """
+    Stores the outcome of a run. Per-row verdicts are written to run_rows and the
+    remaining document to runs.report_json.
+    """
+    with _lock:
+        conn = _get_conn()
+        agent_row = conn.execute("SELECT agent_id FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if agent_row is None:
+            return False
+        agent_id = agent_row[0]
+
+        document, rows = split_report(agent_id, report) if report is not None else (None, [])
+        row_values = []
+        for index, row in enumerate(rows):
+            key, level, score = _row_fields(agent_id, row) if isinstance(row, dict) else (None, None, None)
+            level = str(level).lower() if level is not None else None
+            score = score if isinstance(score, (int, float)) else None
+            row_values.append((run_id, index, key, level, RISK_RANK.get(level, 0), score, json.dumps(row, default=str)))
+
+        conn.execute("DELETE FROM run_rows WHERE run_id = ?", (run_id,))
+        conn.executemany(
+            "INSERT INTO run_rows (run_id, row_index, row_key, risk_level, risk_rank, score, row_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            row_values,
+        )
+        conn.execute(
+            "UPDATE runs SET status = ?, completed_at = ?, duration = ?, error = ?, report_json = ?, row_count = ? "
+            "WHERE run_id = ?",
+            (
+                status,
+                completed_at or utc_now(),
+                duration,
+                error,
+                json.dumps(document, default=str) if document is not None else None,
+                len(row_values),
+                run_id,
+            ),
+        )
+        conn.execute("DELETE FROM runs_fts WHERE run_id = ?", (run_id,))
+        conn.execute(
+            "INSERT INTO runs_fts (run_id, summary) VALUES (?, ?)",
+            (run_id, _summary_text(run_id, agent_id, document if document is not None else error)),
+        )
+        conn.commit()
+    return True
+
+
+def get_run(run_id, include_rows=True):
+    """
+    Returns a run in the frontend's AgentRun shape, or None.
+    With include_rows=False the row array in resultJson is left empty; use get_run_rows to page it.
+    """
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            f"SELECT {_RUN_COLUMNS}, report_json FROM runs WHERE run_id = ?", (run_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        verdicts = []
+        if include_rows and row[9]:
+            verdicts = [json.loads(r[0]) for r in conn.execute(
+                "SELECT row_json FROM run_rows WHERE run_id = ? ORDER BY row_index", (run_id,)
+            )]
+
+    run = _to_run(row[:9], row[9])
+    path = ROW_SECTIONS.get(run["agentId"])
+    if include_rows and path and isinstance(run.get("resultJson"), dict):
+        parent = _get_path(run["resultJson"], path)
+        if parent is not None and path[-1] in parent:
+            parent[path[-1]] = verdicts
+    return run
+
+
+def get_run_rows(run_id, offset=0, limit=50, sort="row_index", order="asc", risk_level=None):
+    """
+    Returns one page of a report's per-row verdicts: {"total", "offset", "limit", "items"}.
+    sort is one of probability_score, risk_level or row_index.
+    """
+    direction = "DESC" if str(order).lower() == "desc" else "ASC"
+    order_by = ROW_SORTS.get(sort, ROW_SORTS["row_index"]).format(order=direction)
+    where = "run_id = ?"
+    params = [run_id]
+    if risk_level:
+        where += " AND risk_level = ?"
+        params.append(str(risk_level).lower())
+
+    with _lock:
+        conn = _get_conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM run_rows WHERE {where}", params).fetchone()[0]
+        items = [json.loads(r[0]) for r in conn.execute(
+            f"SELECT row_json FROM run_rows WHERE {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )]
+    return {"total": total, "offset": int(offset), "limit": int(limit), "items": items}
+
+
+def _fts_query(search):
+    terms = [t.replace('"', "") for t in search.split()]
+    return " ".join(f'"{t}"*' for t in terms if t)
+
+
+def _exclusive_date_bound(date_to):
+    """
+    Returns the exclusive upper bound for a date_to filter: the start of the next day
+    for a date-only value, otherwise the value itself.
+    """
+    try:
+        day = date.fromisoformat(date_to)
+    except ValueError:
+        return date_to
+    return (day + timedelta(days=1)).isoformat()
+
+
+def list_runs(agent_id=None, status=None, search=None, date_from=None, date_to=None, limit=200, offset=0):
+    """
+    Returns runs matching the frontend's listRuns filters, newest first, without result JSON.
+    search matches run ids and report summaries (prefix match per term).
+    """
+    where = []
+    params = []
+    if agent_id:
+        where.append("agent_id = ?")
+        params.append(agent_id)
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if date_from:
+        where.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        # Date-only bounds include the whole day
+        where.append("created_at < ?")
+        params.append(_exclusive_date_bound(date_to))
+    if search and _fts_query(search):
+        where.append("run_id IN (SELECT run_id FROM runs_fts WHERE runs_fts MATCH ?)")
+        params.append(_fts_query(search))
+
+    sql = f"SELECT {_RUN_COLUMNS} FROM runs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+
+    with _lock:
+        conn = _get_conn()
+        rows = conn.execute(sql, params + [int(limit), int(offset)]).fetchall()
+    return [_to_run(row) for row in rows]
+
+
+def count_runs_by_status():
+    with _lock:
+        conn = _get_conn()
+        return dict(conn.execute("SELECT status, COUNT(*) FROM runs GROUP BY status").fetchall())
+
+
+def fail_interrupted_runs():
+    """
+    Marks runs left queued or running by a previous process as failed. Returns the number updated.
+    """
+    with _lock:
+        conn = _get_conn()
+        cursor = conn.execute(
+            "UPDATE runs SET status = 'failure', completed_at = ?, error = ? "
+            "WHERE status IN ('queued', 'running')",
+            (utc_now(), "Run interrupted by worker restart."),
+        )
+        conn.commit()
+        return cursor.rowcount
+
+
+def import_report(path, agent_id):
+    """
+    Imports a saved agent output file (e.g. outputs/agent_1_output.json) as a successful run.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    run_id = create_run(agent_id, {"importedFrom": os.path.basename(path)})
+    complete_run(run_id, "success", report=report)
+    return run_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP agent run store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import saved agent output files as runs")
+    import_parser.add_argument("agent_id", choices=sorted(ROW_SECTIONS))
+    import_parser.add_argument("paths", nargs="+")
+    list_parser = subparsers.add_parser("list", help="List stored runs")
+    list_parser.add_argument("--agent")
+    list_parser.add_argument("--status")
+    list_parser.add_argument("--search")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for report_path in args.paths:
+            print(f"Imported {report_path} as run {import_report(report_path, args.agent_id)}")
+    elif args.command == "list":
+        json.dump(list_runs(args.agent, args.status, args.search), sys.stdout, indent=2)
+        print()
@@ -0,0 +1,287 @@
+import os
+import copy
+import json
+import math
+import time
+import hashlib
+import random
+from collections import defaultdict
+
+from output_schemas import AGENT_SCHEMAS
+from production_aggregates import parse_date, parse_scrap
+
+# Embedding-free similarity index for near-duplicate rows.
+# Each row becomes a set of features (categorical values, bucketed numerics and
+# week-bucketed dates). MinHash signatures are banded into an LSH index to find
+# candidate representatives, and the exact Jaccard similarity of the feature
+# sets decides whether a row joins a group. Only one representative per group
+# is sent to the model; its verdict is copied to the other members with their
+# own per-row fields (ids, quantities, ...) written back.
+
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+# Relative width of numeric buckets (0.25 -> values within ~25% share a bucket)
+SIMILARITY_NUMERIC_BUCKET = float(os.getenv("SIMILARITY_NUMERIC_BUCKET", "0.25"))
+
+NUM_PERM = 32
+BANDS = 8
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+def _number(value):
+    try:
+        return float(str(value).strip().rstrip("%").replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def _days_of_supply(row):
+    stock = _number(row.get("CurrentStock"))
+    consumption = _number(row.get("DailyConsumption"))
+    if stock is None or not consumption or consumption <= 0:
+        return None
+    return stock / consumption
+
+
+# Per agent: the features rows are compared on, and the per-row fields kept on
+# fanned-out verdicts (output path -> source field, copied as a string like the
+# model writes ids and dates, or a callable on the source row for typed values).
+SIMILARITY_SPECS = {
+    "agent_1": {
+        "categorical": ("Customer", "Material", "Status"),
+        "numeric": {"Qty": lambda row: _number(row.get("Qty"))},
+        "dates": ("DeliveryDate",),
+        "row_fields": {
+            "sales_order": "SalesOrder",
+            "customer": "Customer",
+            "material": "Material",
+            "qty": lambda row: _number(row.get("Qty")),
+            "delivery_date": "DeliveryDate",
+            "status": "Status",
+        },
+    },
+    "agent_4": {
+        "categorical": ("Plant",),
+        "numeric": {
+            "DaysOfSupply": _days_of_supply,
+            "DailyConsumption": lambda row: _number(row.get("DailyConsumption")),
+        },
+        "dates": (),
+        "row_fields": {
+            "material": "Material",
+            "plant": "Plant",
+            "inputs.current_stock": lambda row: _number(row.get("CurrentStock")),
+            "inputs.daily_consumption": lambda row: _number(row.get("DailyConsumption")),
+        },
+    },
+    "agent_5": {
+        "categorical": ("WorkCenter", "Status"),
+        "numeric": {
+            "Scrap%": lambda row: parse_scrap(row.get("Scrap%")),
+            "overlapping_orders_count": lambda row: _number(row.get("overlapping_orders_count")),
+        },
+        "dates": ("StartDate", "EndDate"),
+        "row_fields": {
+            "production_order": "ProdOrder",
+            "work_center": "WorkCenter",
+            "inputs.start_date": "StartDate",
+            "inputs.end_date": "EndDate",
+            "inputs.status": "Status",
+            "inputs.scrap_percent": lambda row: parse_scrap(row.get("Scrap%")),
+        },
+    },
+}
+
+
+def _bucket(value):
+    """
+    Log-scale bucket, so the tolerance is relative to the magnitude of the value.
+    """
+    if value is None:
+        return "none"
+    if value == 0:
+        return "0"
+    sign = "-" if value < 0 else ""
+    return f"{sign}{math.floor(math.log(abs(value)) / math.log1p(SIMILARITY_NUMERIC_BUCKET))}"
+
+
+def row_features(row, spec):
+    """
+    Returns the feature set of a row: field=value for categorical fields, log buckets
+    for numerics and ISO year-week buckets for dates.
+    """
+    features = set()
+    for field in spec["categorical"]:
+        features.add(f"{field}={str(row.get(field) or '').strip().lower()}")
+    for name, extract in spec["numeric"].items():
+        features.add(f"{name}~{_bucket(extract(row))}")
+    for field in spec["dates"]:
+        parsed = parse_date(row.get(field))
+        if parsed:
+            year, week, _ = parsed.isocalendar()
+            features.add(f"{field}@{year}-W{week:02d}")
+        else:
+            features.add(f"{field}@{str(row.get(field) or '').strip()}")
+    return features
+
+
+def minhash(features):
+    """
+    MinHash signature (NUM_PERM values) of a feature set.
+    """
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in features]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def group_rows(rows, spec, threshold=None):
+    """
+    Groups near-duplicate rows. Each row is compared with the representatives found
+    so far that share at least one LSH band; it joins the first one whose feature
+    sets have Jaccard similarity >= threshold, otherwise it becomes a new representative.
+    Returns a list of groups (lists of row indices, representative first), in source order.
+    """
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    rows_per_band = NUM_PERM // BANDS
+    buckets = defaultdict(list)  # (band, band signature) -> group indices
+    groups = []
+    group_features = []
+
+    for index, row in enumerate(rows):
+        features = row_features(row, spec)
+        signature = minhash(features)
+        bands = [(band, signature[band * rows_per_band:(band + 1) * rows_per_band]) for band in range(BANDS)]
+
+        match = None
+        seen = set()
+        for band in bands:
+            for group_index in buckets.get(band, ()):
+                if group_index in seen:
+                    continue
+                seen.add(group_index)
+                if jaccard(features, group_features[group_index]) >= threshold:
+                    match = group_index
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            groups.append([index])
+            group_features.append(features)
+            for band in bands:
+                buckets[band].append(len(groups) - 1)
+        else:
+            groups[match].append(index)
+    return groups
+
+
+def _key(item, fields):
+    return tuple(str(item.get(field) if item.get(field) is not None else "").strip() for field in fields)
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _set_path(item, path, value):
+    *parents, last = path.split(".")
+    for name in parents:
+        child = item.get(name)
+        if not isinstance(child, dict):
+            child = {}
+            item[name] = child
+        item = child
+    item[last] = value
+
+
+def _estimate_tokens(rows):
+    # Roughly 4 characters per token for the JSON the agents send and receive
+    return len(json.dumps(rows, indent=2, default=str)) // 4
+
+
+def analyze_grouped(agent_id, rows, analyze, on_item=None, threshold=None, refresh=None):
+    """
+    Sends one representative per group of near-duplicate rows to analyze(representatives)
+    and copies each representative's verdict to the rest of its group, with the
+    member's own per-row fields. refresh(verdict, row), if given, recomputes any other
+    row-specific values on a copied verdict. Representatives are sent as plain source
+    rows; the agents recompute their portfolio-level sections from the expanded rows.
+    Grouping stats are stored in report["meta"]["similarity"] and meta.row_count is set
+    to the full row count. Non-dict results are returned unchanged.
+    """
+    spec = SIMILARITY_SPECS[agent_id]
+    schema = AGENT_SCHEMAS[agent_id]
+
+    started = time.perf_counter()
+    groups = group_rows(rows, spec, threshold)
+    grouping_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    representatives = [rows[group[0]] for group in groups]
+
+    stats = {
+        "rows": len(rows),
+        "groups": len(groups),
+        "grouping_ratio": round(len(rows) / len(groups), 2) if groups else 1.0,
+        "fanned_out_rows": len(rows) - len(groups),
+        "estimated_input_tokens": _estimate_tokens(rows),
+        "estimated_input_tokens_sent": _estimate_tokens(representatives),
+        "estimated_output_tokens_saved": 0,
+        "grouping_ms": grouping_ms,
+    }
+    print(f"   Grouped {stats['rows']} rows into {stats['groups']} similarity groups "
+          f"(ratio {stats['grouping_ratio']}) in {grouping_ms} ms.")
+
+    report = analyze(representatives)
+    if not isinstance(report, dict):
+        return report
+
+    container = report
+    for name in schema["path"][:-1]:
+        container = container.get(name) if isinstance(container, dict) else None
+    verdicts = container.get(schema["path"][-1]) if isinstance(container, dict) else None
+    if not isinstance(verdicts, list):
+        return report
+
+    by_key = {}
+    for verdict in verdicts:
+        if isinstance(verdict, dict):
+            by_key.setdefault(_key(verdict, schema["row_key"]), verdict)
+
+    expanded = []
+    copied = []
+    for group in groups:
+        verdict = by_key.get(_key(rows[group[0]], schema["source_key"]))
+        if verdict is None:
+            # Left for reconciliation to re-request
+            continue
+        expanded.append(verdict)
+        for index in group[1:]:
+            member = copy.deepcopy(verdict)
+            for path, source in spec["row_fields"].items():
+                _set_path(member, path, source(rows[index]) if callable(source) else _text(rows[index].get(source)))
+            if refresh is not None:
+                refresh(member, rows[index])
+            member["reused_verdict_from"] = "/".join(_key(verdict, schema["row_key"]))
+            expanded.append(member)
+            copied.append(member)
+            if on_item is not None:
+                on_item(member)
+
+    container[schema["path"][-1]] = expanded
+    stats["estimated_output_tokens_saved"] = _estimate_tokens(copied) if copied else 0
+    stats["estimated_tokens_saved"] = (
+        stats["estimated_input_tokens"] - stats["estimated_input_tokens_sent"] + stats["estimated_output_tokens_saved"]
+    )
+
+    meta = report.setdefault("meta", {})
+    if isinstance(meta, dict):
+        meta["row_count"] = len(rows)
+        meta["similarity"] = stats
+    print(f"   Reused {len(copied)} verdicts; ~{stats['estimated_tokens_saved']} tokens saved.")
+    return report
@@ -0,0 +1,90 @@
+import os
+import re
+from datetime import date
+
+import inventory_rules
+
+PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "system-prompts", "system-prompt-4.txt")
+
+
+def test_defaults_match_system_prompt():
+    with open(PROMPT_PATH, encoding="utf-8") as f:
+        prompt = f.read()
+
+    lead_time = re.search(r"lead_time_days = LeadTimeDays if present else (\d+)", prompt)
+    buffer = re.search(r"buffer_days = (\d+) \(default\)", prompt)
+    assert int(lead_time.group(1)) == inventory_rules.DEFAULT_LEAD_TIME_DAYS
+    assert int(buffer.group(1)) == inventory_rules.DEFAULT_BUFFER_DAYS
+
+
+def test_compute_reorder_with_defaults():
+    result = inventory_rules.compute_reorder({"CurrentStock": 100, "DailyConsumption": 10}, "2024-03-01")
+
+    assert result["days_of_supply"] == 10
+    assert result["stockout_in_days"] == 10
+    assert result["stockout_date"] == "2024-03-11"
+    # target = 10 * 7 + 10 * 7 = 140
+    assert result["suggested_reorder_qty"] == 40
+    assert result["urgency"] == "P1"
+
+
+def test_compute_reorder_with_optional_fields():
+    item = {
+        "CurrentStock": 50,
+        "DailyConsumption": 10,
+        "SafetyStock": 20,
+        "LeadTimeDays": 3,
+        "BufferDays": 2,
+        "MinOrderQty": 30,
+        "LotSize": 25,
+    }
+    result = inventory_rules.compute_reorder(item, "2024-03-01")
+
+    # Urgency uses CurrentStock / DailyConsumption; the stockout uses the safety threshold
+    assert result["days_of_supply"] == 5
+    assert result["urgency"] == "P1"
+    assert result["stockout_in_days"] == 3
+    # target = 20 + 30 + 20 = 70 -> raw 20 -> MOQ 30 -> lot size 50
+    assert result["suggested_reorder_qty"] == 50
+    assert result["calculation_trace"]["adjustments_applied"] == ["min_order_qty_enforced", "rounded_to_lot_size"]
+
+
+def test_compute_reorder_rejects_invalid_rows():
+    assert inventory_rules.compute_reorder({"CurrentStock": 10, "DailyConsumption": 0}, "2024-03-01") is None
+    assert inventory_rules.compute_reorder({"CurrentStock": -1, "DailyConsumption": 5}, "2024-03-01") is None
+
+
+def test_apply_reorder_rules_marks_recomputed_fields():
+    forecast = {
+        "material": "M1",
+        "plant": "1010",
+        "days_of_supply": 30,
+        "stockout_forecast": {"stockout_date": "2024-03-31", "stockout_in_days": 30},
+        "reorder_recommendation": {"urgency": "P2", "suggested_reorder_qty": 0, "rationale": "Plenty of stock."},
+        "recommended_actions": [{"priority": "P2", "action": "Monitor stock levels", "rationale": "Plenty of stock."}],
+        "demand_trend": {"trend": "stable"},
+    }
+    inventory_rules.apply_reorder_rules(forecast, {"CurrentStock": 20, "DailyConsumption": 10}, "2024-03-01")
+
+    assert forecast["reorder_recommendation"]["urgency"] == "P0"
+    assert forecast["reorder_recommendation"]["suggested_reorder_qty"] == 120
+    assert forecast["stockout_forecast"]["stockout_date"] == "2024-03-03"
+    assert [action["priority"] for action in forecast["recommended_actions"]] == ["P0", "P1"]
+    assert "120 units" in forecast["recommended_actions"][0]["action"]
+    assert forecast["recomputed_locally"] == list(inventory_rules.LOCAL_FIELDS)
+    assert forecast["demand_trend"] == {"trend": "stable"}
+
+
+def test_apply_reorder_rules_for_invalid_row():
+    forecast = {"forecast_status": "available", "reorder_recommendation": {"urgency": "P1"}}
+    inventory_rules.apply_reorder_rules(forecast, {"CurrentStock": 20, "DailyConsumption": 0}, "2024-03-01")
+
+    assert forecast["forecast_status"] == "not_available"
+    assert forecast["reorder_recommendation"]["urgency"] == "not_available"
+    assert forecast["stockout_forecast"]["stockout_date"] is None
+
+
+def test_resolve_as_of_date_falls_back_to_today():
+    assert inventory_rules.resolve_as_of_date("2024-03-01") == "2024-03-01"
+    assert inventory_rules.resolve_as_of_date("03/01/2024") == date.today().isoformat()
+    assert inventory_rules.resolve_as_of_date(None) == date.today().isoformat()
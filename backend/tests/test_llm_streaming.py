@@ -0,0 +1,76 @@
+import json
+from types import SimpleNamespace
+
+from llm_streaming import JsonArrayItemScanner, stream_json_completion
+
+DOCUMENT = {
+    "meta": {"row_count": 2, "orders": [{"sales_order": "meta-level, not an item"}]},
+    "late_delivery_probability": {
+        "summary": {"probability_distribution": {"high": 1}},
+        "orders": [
+            {"sales_order": "1001", "risk_reasons": ["Quoted \"late\" twice", "brace } and [ in text"]},
+            {"sales_order": "1002", "nested": {"orders": [{"sales_order": "inner"}]}, "risk_reasons": []},
+        ],
+    },
+}
+ITEM_PATH = ("late_delivery_probability", "orders")
+
+
+def _feed_in_chunks(text, size):
+    scanner = JsonArrayItemScanner(ITEM_PATH)
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(scanner.feed(text[start:start + size]))
+    return scanner, items
+
+
+def test_items_are_emitted_for_every_chunk_size():
+    text = json.dumps(DOCUMENT, indent=2)
+    expected = DOCUMENT["late_delivery_probability"]["orders"]
+    for size in (1, 2, 3, 7, 64, len(text)):
+        scanner, items = _feed_in_chunks(text, size)
+        assert items == expected, f"chunk size {size}"
+        assert json.loads(scanner.data) == DOCUMENT
+
+
+def test_escaped_quotes_and_braces_inside_strings():
+    text = '{"late_delivery_probability": {"orders": [{"sales_order": "a\\"}{", "note": "] [ } {"}]}}'
+    _, items = _feed_in_chunks(text, 1)
+    assert items == [{"sales_order": 'a"}{', "note": "] [ } {"}]
+
+
+def test_escaped_backslash_before_closing_quote():
+    text = '{"late_delivery_probability": {"orders": [{"path": "C:\\\\"}, {"path": "x"}]}}'
+    _, items = _feed_in_chunks(text, 1)
+    assert items == [{"path": "C:\\"}, {"path": "x"}]
+
+
+def test_nested_arrays_repeating_the_target_key_are_not_items():
+    # "orders" nested inside an item, or under another parent, must not be emitted
+    _, items = _feed_in_chunks(json.dumps(DOCUMENT), 5)
+    assert [item["sales_order"] for item in items] == ["1001", "1002"]
+
+
+def test_items_arrive_before_the_document_is_complete():
+    text = json.dumps(DOCUMENT)
+    cut = text.index('"1002"')
+    scanner = JsonArrayItemScanner(ITEM_PATH)
+    items = scanner.feed(text[:cut])
+    assert [item["sales_order"] for item in items] == ["1001"]
+    assert [item["sales_order"] for item in scanner.feed(text[cut:])] == ["1002"]
+
+
+def test_stream_json_completion_calls_on_item_and_returns_document():
+    text = json.dumps(DOCUMENT)
+
+    def chunk(content):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+    chunks = [SimpleNamespace(choices=[])] + [chunk(text[i:i + 10]) for i in range(0, len(text), 10)] + [chunk(None)]
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: iter(chunks)))
+    )
+    received = []
+    result = stream_json_completion(client, [], ITEM_PATH, received.append, model="test")
+    assert result == DOCUMENT
+    assert received == DOCUMENT["late_delivery_probability"]["orders"]
@@ -0,0 +1,131 @@
+from output_schemas import combine_stats, fill_missing_rows, reconcile_and_repair
+
+
+def _source(*keys):
+    return [{"Supplier": key} for key in keys]
+
+
+def _scorecard(supplier, risk_score=40):
+    return {
+        "supplier": supplier,
+        "risk_assessment": {"risk_score": risk_score, "risk_level": "medium"},
+        "recommended_actions": [],
+    }
+
+
+def _report(*rows):
+    return {"supplier_scorecards": list(rows)}
+
+
+def _suppliers(report):
+    return [row["supplier"] for row in report["supplier_scorecards"]]
+
+
+def test_valid_rows_are_kept_in_source_order():
+    report = reconcile_and_repair("agent_3", _report(_scorecard("B"), _scorecard("A")), _source("A", "B"))
+
+    assert _suppliers(report) == ["A", "B"]
+    stats = report["meta"]["reconciliation"]
+    assert stats["valid_rows"] == 2
+    assert stats["missing_rows"] == 0
+    assert stats["repair_requests"] == 0
+
+
+def test_schema_violations_are_dropped_and_flagged():
+    report = reconcile_and_repair(
+        "agent_3", _report(_scorecard("A", risk_score=250), {"supplier": "B"}), _source("A", "B")
+    )
+
+    stats = report["meta"]["reconciliation"]
+    assert stats["invalid_rows"] == 2
+    assert stats["placeholder_rows"] == 2
+    assert [row["risk_assessment"]["risk_level"] for row in report["supplier_scorecards"]] == ["unknown", "unknown"]
+
+
+def test_duplicate_and_unexpected_rows_are_dropped():
+    first = _scorecard("A", risk_score=10)
+    report = reconcile_and_repair(
+        "agent_3", _report(first, _scorecard("A", risk_score=90), _scorecard("Z")), _source("A")
+    )
+
+    assert report["supplier_scorecards"] == [first]
+    stats = report["meta"]["reconciliation"]
+    assert stats["duplicate_rows"] == 1
+    assert stats["unexpected_rows"] == 1
+
+
+def test_one_repair_round_requests_only_missing_rows():
+    requests = []
+
+    def reanalyze(rows):
+        requests.append([row["Supplier"] for row in rows])
+        return _report(*(_scorecard(row["Supplier"]) for row in rows))
+
+    report = reconcile_and_repair("agent_3", _report(_scorecard("A")), _source("A", "B", "C"), reanalyze)
+
+    assert requests == [["B", "C"]]
+    assert _suppliers(report) == ["A", "B", "C"]
+    assert report["meta"]["reconciliation"]["repaired_rows"] == 2
+
+
+def test_rows_still_missing_after_repair_get_placeholders():
+    requests = []
+
+    def reanalyze(rows):
+        requests.append(len(rows))
+        return "Error during analysis: timeout"
+
+    report = reconcile_and_repair("agent_3", _report(_scorecard("A")), _source("A", "B"), reanalyze, max_repair_rounds=1)
+
+    assert requests == [1]
+    assert _suppliers(report) == ["A", "B"]
+    assert report["supplier_scorecards"][1]["risk_assessment"]["risk_level"] == "unknown"
+    assert report["meta"]["reconciliation"]["placeholder_rows"] == 1
+
+
+def test_fill_missing_false_leaves_rows_out():
+    report = reconcile_and_repair("agent_3", _report(_scorecard("A")), _source("A", "B"), fill_missing=False)
+
+    assert _suppliers(report) == ["A"]
+    assert report["meta"]["reconciliation"]["missing_rows"] == 1
+    assert fill_missing_rows("agent_3", report, _source("A", "B")) == 1
+    assert _suppliers(report) == ["A", "B"]
+
+
+def test_failed_report_is_repaired_as_all_rows_missing():
+    requests = []
+
+    def reanalyze(rows):
+        requests.append([row["Supplier"] for row in rows])
+        return _report(_scorecard("A"))
+
+    report = reconcile_and_repair("agent_3", "Error during analysis: bad JSON", _source("A", "B"), reanalyze)
+
+    assert requests == [["A", "B"]]
+    assert _suppliers(report) == ["A", "B"]
+    assert report["meta"]["analysis_error"] == "Error during analysis: bad JSON"
+    stats = report["meta"]["reconciliation"]
+    assert stats["repaired_rows"] == 1
+    assert stats["placeholder_rows"] == 1
+
+
+def test_failed_report_builds_nested_path():
+    report = reconcile_and_repair("agent_4", None, [{"Material": "M1", "Plant": 1010}])
+
+    forecast = report["inventory_forecasts"][0]
+    assert (forecast["material"], forecast["plant"], forecast["forecast_status"]) == ("M1", "1010", "not_available")
+
+    report = reconcile_and_repair("agent_1", "Error", [{"SalesOrder": "SO-1"}], fill_missing=True)
+    assert report["late_delivery_probability"]["orders"] == []
+    assert report["meta"]["reconciliation"]["missing_rows"] == 1
+
+
+def test_source_rows_without_keys_skip_reconciliation():
+    assert reconcile_and_repair("agent_3", "Error", [{"Name": "x"}]) == "Error"
+
+
+def test_combine_stats_sums_per_batch_stats():
+    assert combine_stats([{"valid_rows": 2, "validation_ms": 0.5}, None, {"valid_rows": 3, "validation_ms": 0.25}]) == {
+        "valid_rows": 5,
+        "validation_ms": 0.75,
+    }
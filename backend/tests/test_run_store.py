@@ -0,0 +1,46 @@
+import pytest
+
+import run_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_store, "RUN_STORE_PATH", str(tmp_path / "runs.sqlite3"))
+    monkeypatch.setattr(run_store, "_conn", None)
+    yield run_store
+    if run_store._conn is not None:
+        run_store._conn.close()
+
+
+def _run_ids(runs):
+    return sorted(run["runId"] for run in runs)
+
+
+def test_date_to_includes_the_whole_day(store):
+    store.create_run("agent_1", run_id="morning", created_at="2024-03-10T00:00:00Z")
+    store.create_run("agent_1", run_id="evening", created_at="2024-03-10T23:59:59.999Z")
+    store.create_run("agent_1", run_id="next-day", created_at="2024-03-11T00:00:00Z")
+
+    assert _run_ids(store.list_runs(date_to="2024-03-10")) == ["evening", "morning"]
+    assert _run_ids(store.list_runs(date_from="2024-03-10", date_to="2024-03-11")) == ["evening", "morning", "next-day"]
+
+
+def test_date_to_with_time_is_used_as_is(store):
+    store.create_run("agent_1", run_id="early", created_at="2024-03-10T08:00:00Z")
+    store.create_run("agent_1", run_id="late", created_at="2024-03-10T18:00:00Z")
+
+    assert _run_ids(store.list_runs(date_to="2024-03-10T12:00:00Z")) == ["early"]
+
+
+def test_search_matches_report_summary_but_not_rows(store):
+    report = {
+        "late_delivery_probability": {
+            "summary": {"top_risk_drivers": ["Backlogged carrier"]},
+            "orders": [{"sales_order": "SO-1", "customer": "Globex", "risk_level": "high"}],
+        }
+    }
+    store.create_run("agent_1", run_id="run-1")
+    store.complete_run("run-1", "success", report=report)
+
+    assert _run_ids(store.list_runs(search="backlog")) == ["run-1"]
+    assert store.list_runs(search="Globex") == []
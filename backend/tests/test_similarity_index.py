@@ -0,0 +1,57 @@
+import similarity_index
+
+
+def _inventory(material, stock, plant=1010):
+    return {"Material": material, "Plant": plant, "CurrentStock": stock, "DailyConsumption": 10}
+
+
+def _forecast(item):
+    return {
+        "material": str(item["Material"]),
+        "plant": str(item["Plant"]),
+        "forecast_status": "available",
+        "inputs": {"current_stock": item["CurrentStock"], "daily_consumption": item["DailyConsumption"]},
+        "reorder_recommendation": {"urgency": "P1"},
+    }
+
+
+def test_group_rows_groups_near_duplicates():
+    rows = [_inventory("M1", 100), _inventory("M2", 101), _inventory("M3", 5000), _inventory("M4", 100, plant=1020)]
+
+    assert similarity_index.group_rows(rows, similarity_index.SIMILARITY_SPECS["agent_4"]) == [[0, 1], [2], [3]]
+
+
+def test_analyze_grouped_copies_verdicts_with_member_fields():
+    rows = [_inventory("M1", 100), _inventory("M2", 101)]
+    sent = []
+
+    def analyze(representatives):
+        sent.append(representatives)
+        return {"meta": {"row_count": len(representatives)}, "inventory_forecasts": [_forecast(r) for r in representatives]}
+
+    refreshed = []
+    report = similarity_index.analyze_grouped(
+        "agent_4", rows, analyze, refresh=lambda forecast, item: refreshed.append(item["Material"])
+    )
+
+    # Representatives are the plain source rows
+    assert sent == [[rows[0]]]
+    assert refreshed == ["M2"]
+    copy = report["inventory_forecasts"][1]
+    assert (copy["material"], copy["plant"]) == ("M2", "1010")
+    assert copy["inputs"]["current_stock"] == 101
+    assert copy["reused_verdict_from"] == "M1/1010"
+    assert report["meta"]["row_count"] == 2
+    assert report["meta"]["similarity"]["fanned_out_rows"] == 1
+
+
+def test_analyze_grouped_leaves_missing_representatives_out():
+    rows = [_inventory("M1", 100), _inventory("M2", 101)]
+
+    report = similarity_index.analyze_grouped("agent_4", rows, lambda representatives: {"inventory_forecasts": []})
+
+    assert report["inventory_forecasts"] == []
+
+
+def test_analyze_grouped_returns_errors_unchanged():
+    assert similarity_index.analyze_grouped("agent_4", [_inventory("M1", 100)], lambda rows: "Error") == "Error"
@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import importlib
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "agents"))
+import hana_connector
+import run_store
+
+# Long-lived agent worker service.
+# Serves the contract expected by frontend/src/lib/api-client.ts:
+#   GET  /api/agents
+#   POST /api/agents/{agentId}/run  -> {"runId": ...}
+#   GET  /api/runs/{runId}            (?rows=false omits the per-row verdicts)
+#   GET  /api/runs?agentId=&status=&search=&from=&to=&limit=&offset=
+#   GET  /api/runs/{runId}/rows?offset=&limit=&sort=&order=&riskLevel=
+#   POST /api/refresh                 -> bulk-fetches HANA data once, then queues a run per agent
+# plus GET /api/metrics for queue depth and run latency.
+# Runs are persisted in the SQLite run store (run_store.py).
+# Agent modules (and their OpenAI clients) are imported once at startup and
+# shared by all worker threads.
+
+load_dotenv()
+
+WORKER_HOST = os.getenv("WORKER_HOST", "0.0.0.0")
+WORKER_PORT = int(os.getenv("WORKER_PORT", "4000"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+WORKER_CORS_ORIGIN = os.getenv("WORKER_CORS_ORIGIN", "*")
+
+AGENTS = [
+    {
+        "id": "agent_1",
+        "name": "Agent 1: Sales & Sentiment Risk",
+        "description": "Late delivery risk, customer sentiment, and prioritized action guidance.",
+    },
+    {
+        "id": "agent_2",
+        "name": "Agent 2: Material Classification",
+        "description": "Material grouping, UNSPSC, hazard labeling, and procurement suggestions.",
+    },
+    {
+        "id": "agent_3",
+        "name": "Agent 3: Supplier Scorecards",
+        "description": "Supplier-level risk scoring, sentiment evidence, and portfolio risk summary.",
+    },
+    {
+        "id": "agent_4",
+        "name": "Agent 4: Inventory Forecasting",
+        "description": "Days-of-supply forecasting, stockout timing, and urgency-based reorder actions.",
+    },
+    {
+        "id": "agent_5",
+        "name": "Agent 5: Production Delay Prediction",
+        "description": "Delay probability, bottleneck identification, and plant-level risk summary.",
+    },
+]
+
+# Run parameters forwarded to each agent's run() function
+RUN_OPTIONS = {
+    "agent_1": ("group_similar",),
+    "agent_2": ("use_memo",),
+    "agent_4": ("sharded", "plants", "group_similar"),
+    "agent_5": ("preaggregate", "group_similar"),
+}
+
+# Run parameters that must be JSON booleans ("false" or "no" would be truthy)
+BOOLEAN_OPTIONS = ("stream", "use_memo", "sharded", "preaggregate", "group_similar")
+
+_agent_modules = {}
+_job_queue = None
+_state_lock = threading.Lock()
+_partial_results = {}  # runId -> verdicts streamed so far, while the run is in progress
+_latencies = {}  # agentId -> deque of run durations (ms)
+_running = 0
+
+
+def load_agents():
+    """
+    Imports every agent module once so clients and configuration stay warm across runs.
+    """
+    for agent in AGENTS:
+        _agent_modules[agent["id"]] = importlib.import_module(agent["id"])
+    print(f"Loaded agents: {', '.join(_agent_modules)}")
+
+
+def get_run(run_id, include_rows=True):
+    """
+    Returns the stored run, with streamed partialResults attached while it is in progress.
+    """
+    run = run_store.get_run(run_id, include_rows)
+    if run is not None:
+        with _state_lock:
+            partial = _partial_results.get(run_id)
+            if partial is not None:
+                run["partialResults"] = list(partial)
+    return run
+
+
+def submit_run(agent_id, parameters):
+    """
+    Queues a run. Returns the new runId, or raises queue.Full when the queue is at capacity.
+    """
+    run_id = run_store.create_run(agent_id, parameters)
+    try:
+        _job_queue.put_nowait(run_id)
+    except queue.Full:
+        run_store.delete_run(run_id)
+        raise
+    return run_id
+
+
+def refresh_agents(agent_ids, consistent=True, parallel=False):
+    """
+    Full refresh: fetches every agent's HANA_QUERY in one bulk fetch (priming the
+    snapshot cache), then queues one run per agent. See fetch_many_from_hana for
+    consistent and parallel (parallel opens one connection per query unless HANA_POOL_SIZE > 0).
+    Returns {"runIds": {agentId: runId}, "fetch": {agentId: row count or error}}.
+    Raises queue.Full if the queue fills up; runs queued before that are kept.
+    """
+    queries = {}
+    for agent_id in agent_ids:
+        query = getattr(_agent_modules[agent_id], "HANA_QUERY", None)
+        if query:
+            queries[agent_id] = query
+
+    fetch = {}
+    if queries:
+        results = hana_connector.fetch_many_from_hana(queries, consistent=consistent, parallel=parallel)
+        for agent_id, result in results.items():
+            fetch[agent_id] = len(result) if isinstance(result, list) else result.get("error")
+
+    run_ids = {}
+    for agent_id in agent_ids:
+        run_ids[agent_id] = submit_run(agent_id, {"refresh": True})
+    return {"runIds": run_ids, "fetch": fetch}
+
+
+def _execute(run_id):
+    global _running
+    run = run_store.get_run(run_id, include_rows=False)
+    if run is None:
+        return
+
+    agent_id = run["agentId"]
+    module = _agent_modules[agent_id]
+    parameters = run.get("parameters") or {}
+    options = {k: parameters[k] for k in RUN_OPTIONS.get(agent_id, ()) if k in parameters}
+
+    partial_results = []
+    on_item = None
+    if parameters.get("stream", True):
+        on_item = partial_results.append
+
+    started = time.monotonic()
+    with _state_lock:
+        _running += 1
+        _partial_results[run_id] = partial_results
+    run_store.update_status(run_id, "running")
+
+    report = None
+    error = None
+    try:
+        result = module.run(on_item=on_item, **options)
+        if isinstance(result, dict):
+            report = result
+        elif result is None:
+            error = "No data found from any source to analyze."
+        else:
+            error = str(result)
+    except Exception as e:
+        error = f"Run failed: {str(e)}"
+
+    duration_ms = int((time.monotonic() - started) * 1000)
+    run_store.complete_run(
+        run_id,
+        "success" if error is None else "failure",
+        report=report,
+        error=error,
+        duration=duration_ms,
+    )
+    with _state_lock:
+        _running -= 1
+        # The stored result supersedes the streamed verdicts
+        _partial_results.pop(run_id, None)
+        _latencies.setdefault(agent_id, deque(maxlen=200)).append(duration_ms)
+
+
+def _worker_loop():
+    while True:
+        run_id = _job_queue.get()
+        try:
+            _execute(run_id)
+        finally:
+            _job_queue.task_done()
+
+
+def start_workers(concurrency=WORKER_CONCURRENCY, queue_size=WORKER_QUEUE_SIZE):
+    """
+    Creates the bounded job queue and starts the worker threads.
+    """
+    global _job_queue
+    _job_queue = queue.Queue(maxsize=queue_size)
+    for index in range(concurrency):
+        threading.Thread(target=_worker_loop, name=f"agent-worker-{index + 1}", daemon=True).start()
+
+
+def get_metrics():
+    """
+    Returns queue depth, run counts by status, and per-agent latency percentiles (ms).
+    """
+    with _state_lock:
+        latencies = {agent_id: sorted(values) for agent_id, values in _latencies.items()}
+        running = _running
+
+    latency_summary = {}
+    for agent_id, values in latencies.items():
+        if values:
+            latency_summary[agent_id] = {
+                "count": len(values),
+                "p50": values[(len(values) - 1) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+
+    return {
+        "queueDepth": _job_queue.qsize() if _job_queue else 0,
+        "queueCapacity": _job_queue.maxsize if _job_queue else 0,
+        "running": running,
+        "runsByStatus": run_store.count_runs_by_status(),
+        "latencyMs": latency_summary,
+        "snapshotCache": hana_connector.get_snapshot_cache_stats(),
+    }
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Access-Control-Allow-Origin", WORKER_CORS_ORIGIN)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", WORKER_CORS_ORIGIN)
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if parts == ["api", "agents"]:
+            return self._send_json(200, AGENTS)
+        if parts == ["api", "metrics"]:
+            return self._send_json(200, get_metrics())
+        try:
+            if parts == ["api", "runs"]:
+                return self._send_json(200, run_store.list_runs(
+                    agent_id=query.get("agentId"),
+                    status=query.get("status"),
+                    search=query.get("search"),
+                    date_from=query.get("from"),
+                    date_to=query.get("to"),
+                    limit=int(query.get("limit", 200)),
+                    offset=int(query.get("offset", 0)),
+                ))
+            if len(parts) == 3 and parts[:2] == ["api", "runs"]:
+                run = get_run(parts[2], include_rows=query.get("rows", "true") != "false")
+                if run is None:
+                    return self._send_json(404, {"error": "Run not found"})
+                return self._send_json(200, run)
+            if len(parts) == 4 and parts[:2] == ["api", "runs"] and parts[3] == "rows":
+                return self._send_json(200, run_store.get_run_rows(
+                    parts[2],
+                    offset=int(query.get("offset", 0)),
+                    limit=int(query.get("limit", 50)),
+                    sort=query.get("sort", "row_index"),
+                    order=query.get("order", "asc"),
+                    risk_level=query.get("riskLevel"),
+                ))
+        except ValueError as e:
+            return self._send_json(400, {"error": f"Invalid query parameter: {str(e)}"})
+        return self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        is_refresh = parts == ["api", "refresh"]
+        if not is_refresh and (len(parts) != 4 or parts[:2] != ["api", "agents"] or parts[3] != "run"):
+            return self._send_json(404, {"error": "Not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            parameters = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(parameters, dict):
+                raise ValueError("payload must be a JSON object")
+        except ValueError as e:
+            return self._send_json(400, {"error": f"Invalid request body: {str(e)}"})
+
+        if is_refresh:
+            agent_ids = parameters.get("agents") or list(_agent_modules)
+            if not isinstance(agent_ids, list):
+                return self._send_json(400, {"error": "Invalid request body: agents must be a list"})
+            unknown = [agent_id for agent_id in agent_ids if agent_id not in _agent_modules]
+            if unknown:
+                return self._send_json(404, {"error": f"Unknown agent: {', '.join(unknown)}"})
+            try:
+                result = refresh_agents(
+                    agent_ids,
+                    consistent=parameters.get("consistent", True),
+                    parallel=parameters.get("parallel", False),
+                )
+            except queue.Full:
+                return self._send_json(503, {"error": "Run queue is full, try again later."})
+            return self._send_json(202, result)
+
+        agent_id = parts[2]
+        if agent_id not in _agent_modules:
+            return self._send_json(404, {"error": f"Unknown agent: {agent_id}"})
+
+        invalid = [name for name in BOOLEAN_OPTIONS if name in parameters and not isinstance(parameters[name], bool)]
+        if invalid:
+            return self._send_json(400, {"error": f"Invalid request body: {', '.join(invalid)} must be true or false"})
+
+        if "plants" in parameters and "plants" in RUN_OPTIONS.get(agent_id, ()):
+            try:
+                parameters["plants"] = _agent_modules[agent_id].parse_plants(parameters["plants"])
+            except ValueError as e:
+                return self._send_json(400, {"error": f"Invalid request body: {str(e)}"})
+
+        try:
+            run_id = submit_run(agent_id, parameters)
+        except queue.Full:
+            return self._send_json(503, {"error": "Run queue is full, try again later."})
+        return self._send_json(202, {"runId": run_id})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(host=WORKER_HOST, port=WORKER_PORT, concurrency=WORKER_CONCURRENCY, queue_size=WORKER_QUEUE_SIZE):
+    print("--- SAP Agent Worker Service ---")
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY not set. Please set it in your .env file or environment.")
+        return
+
+    # Keep one idle HANA connection per worker
+    hana_connector.configure_connection_pool(max(hana_connector.HANA_POOL_SIZE, concurrency))
+    interrupted = run_store.fail_interrupted_runs()
+    if interrupted:
+        print(f"Marked {interrupted} interrupted runs as failed.")
+    load_agents()
+    start_workers(concurrency, queue_size)
+
+    server = ThreadingHTTPServer((host, port), AgentRequestHandler)
+    print(f"Listening on http://{host}:{port} ({concurrency} workers, queue size {queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SAP Agent Worker Service")
+    parser.add_argument("--host", default=WORKER_HOST)
+    parser.add_argument("--port", type=int, default=WORKER_PORT)
+    parser.add_argument("--workers", type=int, default=WORKER_CONCURRENCY, help="Number of concurrent agent runs")
+    parser.add_argument("--queue-size", type=int, default=WORKER_QUEUE_SIZE, help="Max queued runs before new runs are rejected")
+    args = parser.parse_args()
+    main(args.host, args.port, args.workers, args.queue_size)
@@ -1,5 +1,5 @@
 ﻿import { AGENTS } from "@/lib/constants";
-import { AgentId, AgentRun, RunStatus } from "@/lib/types";
+import { AgentId, AgentRun, RunRowSort, RunRowsPage, RunStatus } from "@/lib/types";
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL;
 
@@ -69,8 +69,29 @@ export async function runAgent(agentId: AgentId, payload?: Record<string, unknow
   });
 }
 
-export async function getRun(runId: string) {
-  return request<AgentRun>(`/api/runs/${runId}`);
+export async function getRun(runId: string, options?: { rows?: boolean }) {
+  const suffix = options?.rows === false ? "?rows=false" : "";
+  return request<AgentRun>(`/api/runs/${runId}${suffix}`);
+}
+
+export interface GetRunRowsParams {
+  offset?: number;
+  limit?: number;
+  sort?: RunRowSort;
+  order?: "asc" | "desc";
+  riskLevel?: string;
+}
+
+export async function getRunRows(runId: string, params?: GetRunRowsParams) {
+  const query = new URLSearchParams();
+  if (params?.offset !== undefined) query.set("offset", String(params.offset));
+  if (params?.limit !== undefined) query.set("limit", String(params.limit));
+  if (params?.sort) query.set("sort", params.sort);
+  if (params?.order) query.set("order", params.order);
+  if (params?.riskLevel) query.set("riskLevel", params.riskLevel);
+
+  const suffix = query.toString() ? `?${query.toString()}` : "";
+  return request<RunRowsPage>(`/api/runs/${runId}/rows${suffix}`);
 }
 
 export interface ListRunsParams {
@@ -24,6 +24,17 @@ export interface AgentRun {
   error?: string;
   parameters?: Record<string, unknown>;
   resultJson?: Record<string, any>;
+  rowCount?: number;
+  partialResults?: Array<Record<string, any>>;
+}
+
+export type RunRowSort = "row_index" | "probability_score" | "risk_level";
+
+export interface RunRowsPage {
+  total: number;
+  offset: number;
+  limit: number;
+  items: Array<Record<string, any>>;
 }
 
 export interface AgentDescriptor {